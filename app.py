@@ -1,87 +1,84 @@
 # app.py
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+import io
+import json
 import os
 import sys
 import threading
 import time
 import tempfile
 import shutil
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename, safe_join
 
 # Add the directory containing script_org.py to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import script_org # Import your modified script
+import jobs
+import metrics
+import staging
+import zipstream
 
 # Initialize Flask app, specifying the current directory as the template folder
 app = Flask(__name__, template_folder='.')
 
-# Configure upload settings
-UPLOAD_FOLDER = tempfile.gettempdir()
+# Configure upload settings. Each upload gets its own directory in a staging
+# area under UPLOAD_FOLDER, which counts the space they use, refuses writes
+# over quota and removes uploads that are no longer used.
+UPLOAD_FOLDER = os.environ.get('ORGANIZER_UPLOAD_FOLDER',
+                               os.path.join(tempfile.gettempdir(), 'organizer_uploads'))
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+UPLOAD_BUFFER_SIZE = 1024 * 1024 # Bytes copied from a chunk request to disk at a time
+app.config['STAGING_QUOTA_BYTES'] = int(os.environ.get('ORGANIZER_STAGING_QUOTA', 20 * 1024 ** 3))
+app.config['STAGING_MIN_FREE_BYTES'] = int(os.environ.get('ORGANIZER_STAGING_MIN_FREE', 1024 ** 3))
+app.config['STAGING_TTL'] = int(os.environ.get('ORGANIZER_STAGING_TTL', 24 * 3600)) # Seconds an unused upload is kept
+app.config['STAGING_REAP_INTERVAL'] = 60 # Seconds between cleanups
 
-# Global variable to store organization status and messages
-organization_status = {
+# Hashes of files already on the server, so uploads of known content can be
+# skipped. SHA-256 because it is what browsers compute (they have no MD5).
+UPLOAD_HASH_ALGORITHM = 'sha256'
+upload_index = script_org.ContentIndex(UPLOAD_HASH_ALGORITHM)
+
+# Organization runs, each with its own id and status. Runs on different
+# folders go on at the same time; runs on the same folder wait their turn.
+app.config['MAX_CONCURRENT_JOBS'] = 4
+# Set ORGANIZE_IN_PROCESSES=1 to run jobs in worker processes, so they
+# neither slow down requests nor share one core
+app.config['ORGANIZE_IN_PROCESSES'] = os.environ.get('ORGANIZE_IN_PROCESSES') == '1'
+job_manager = jobs.JobManager(max_workers=app.config['MAX_CONCURRENT_JOBS'],
+                              processes=app.config['ORGANIZE_IN_PROCESSES'])
+
+# Uploads a job is working on are never removed
+staging_area = staging.StagingArea(app.config['UPLOAD_FOLDER'], app.config['STAGING_QUOTA_BYTES'],
+                                   min_free_bytes=app.config['STAGING_MIN_FREE_BYTES'],
+                                   ttl=app.config['STAGING_TTL'], busy=job_manager.busy)
+staging_area.start_reaper(app.config['STAGING_REAP_INTERVAL'])
+
+# Status reported by /status before any organization has been started
+IDLE_STATUS = {
     "running": False,
-    "progress": 0, # Percentage
+    "progress": 0,
     "messages": [],
     "error": None,
     "completed": False,
-    "current_step": ""
+    "current_step": "",
+    "dry_run": False,
+    "has_preview": False,
+    "cursor": 0
 }
 
-def run_organization_task(folder_path):
-    global organization_status
-    organization_status["running"] = True
-    organization_status["progress"] = 0
-    organization_status["messages"] = []
-    organization_status["error"] = None
-    organization_status["completed"] = False
-    organization_status["current_step"] = "Starting organization..."
+# Seconds an event stream waits for news before sending a keep-alive comment
+EVENT_KEEPALIVE = 15
+# Shortest time between two progress events; messages logged in between are
+# sent together in the next one
+EVENT_INTERVAL = 0.25
 
-    try:
-        # Override the _log_progress function in script_org to capture messages
-        original_log_progress = script_org._log_progress
-        step_count = 0
-        
-        def web_log_progress(message):
-            nonlocal step_count
-            original_log_progress(message) # Still print to console
-            organization_status["messages"].append(message)
-            
-            # Update progress based on step indicators
-            if message.startswith("Step"):
-                step_count += 1
-                organization_status["progress"] = min(90, step_count * 15)
-                organization_status["current_step"] = message
-            elif "complete" in message.lower():
-                organization_status["progress"] = 100
-                organization_status["current_step"] = "Organization completed!"
-            else:
-                # Gradual progress increase for other messages
-                organization_status["progress"] = min(95, organization_status["progress"] + 1)
-        
-        script_org._log_progress = web_log_progress
-
-        success, messages = script_org.organize_files_web(folder_path)
-        organization_status["messages"] = messages # Ensure all messages are captured
-        organization_status["completed"] = True
-        organization_status["progress"] = 100
-        organization_status["current_step"] = "Organization completed!"
-        
-        if not success:
-            organization_status["error"] = "Organization failed. Check logs for details."
-    except Exception as e:
-        organization_status["error"] = str(e)
-        organization_status["messages"].append(f"An unexpected error occurred: {e}")
-        organization_status["completed"] = True
-        organization_status["progress"] = 100
-        organization_status["current_step"] = "Error occurred"
-    finally:
-        organization_status["running"] = False
-        # Restore original log function
-        script_org._log_progress = original_log_progress
+@app.errorhandler(staging.StagingFull)
+def staging_full(error):
+    return jsonify({"status": "error", "message": str(error)}), 507
 
 @app.route('/')
 def index():
@@ -89,49 +86,375 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    if 'files' not in request.files:
-        return jsonify({"status": "error", "message": "No files uploaded."}), 400
+    # Create a directory for this upload, with room for the whole request
+    upload_id = staging_area.create()
+    upload_dir = staging_area.get(upload_id)
+    try:
+        staging_area.reserve(upload_id, request.content_length or 0)
+    except staging.StagingFull:
+        staging_area.remove(upload_id)
+        raise
+    saved_files = []
+    
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # Each file part is written straight to its place in upload_dir as
+        # the request is parsed, instead of being spooled first
+        if not filename:
+            return tempfile.SpooledTemporaryFile() # Empty file input, discarded
+        # The filename is the relative path from the webkitRelativePath
+        file_path = safe_join(upload_dir, filename)
+        if file_path is None:
+            raise ValueError(f"Invalid file path: {filename}")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file = open(file_path, 'wb')
+        saved_files.append(file)
+        return file
+    
+    try:
+        # However long the request takes, the upload is not idle meanwhile
+        with staging_area.writing(upload_id):
+            parse_form_data(request.environ, stream_factory=stream_factory,
+                            max_content_length=app.config['MAX_CONTENT_LENGTH'], silent=False)
+    except RequestEntityTooLarge:
+        staging_area.remove(upload_id)
+        raise
+    except ValueError as e:
+        staging_area.remove(upload_id)
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        staging_area.remove(upload_id)
+        return jsonify({"status": "error", "message": f"Upload failed: {str(e)}"}), 500
+    finally:
+        for file in saved_files:
+            file.close()
     
-    files = request.files.getlist('files')
-    if not files or files[0].filename == '':
+    if not saved_files:
+        staging_area.remove(upload_id)
         return jsonify({"status": "error", "message": "No files selected."}), 400
+    staging_area.refresh(upload_id)
     
-    # Create a temporary directory for this upload
-    upload_dir = tempfile.mkdtemp()
+    return jsonify({
+        "status": "success", 
+        "message": "Files uploaded successfully.",
+        "upload_id": upload_id,
+        "upload_path": upload_dir
+    })
+
+# Chunked uploads: POST /upload/start, then for every file PUT its bytes in
+# order to /upload/<upload_id>/chunk. A file is written to '<path>.part' and
+# renamed to its path once all of it has arrived. After a dropped connection
+# /upload/<upload_id>/status tells the client where to resume.
+
+# Files a chunk is being written to right now. A chunk that arrives while
+# another one of the same file is still streaming (a client retrying too
+# early) is refused, so both cannot append at the same offset.
+_receiving = set()
+_receiving_lock = threading.Lock()
+
+def _upload_dir(upload_id):
+    """Folder of an upload, or None if upload_id is not a known upload"""
+    return staging_area.get(upload_id)
+
+def _chunked_upload_file():
+    """Return (upload_dir, file_path) for the request, or an error response"""
+    upload_dir = _upload_dir(request.view_args['upload_id'])
+    if upload_dir is None:
+        return None, (jsonify({"status": "error", "message": "Unknown upload."}), 404)
     
+    relative_path = request.args.get('path', '')
+    file_path = safe_join(upload_dir, relative_path) if relative_path else None
+    if file_path is None:
+        return None, (jsonify({"status": "error", "message": "A valid file path is required."}), 400)
+    return file_path, None
+
+def _received(file_path):
+    """(bytes received so far, whether the file is complete)"""
+    if os.path.isfile(file_path):
+        return os.path.getsize(file_path), True
     try:
-        # Process uploaded files and recreate folder structure
-        folder_structure = {}
-        
-        for file in files:
-            if file.filename == '':
+        return os.path.getsize(file_path + '.part'), False
+    except OSError:
+        return 0, False
+
+@app.route('/upload/start', methods=['POST'])
+def start_upload():
+    upload_id = staging_area.create()
+    return jsonify({
+        "status": "success",
+        "upload_id": upload_id,
+        "upload_path": staging_area.get(upload_id)
+    })
+
+@app.route('/upload/<upload_id>/chunk', methods=['PUT'])
+def upload_chunk(upload_id):
+    file_path, error = _chunked_upload_file()
+    if error:
+        return error
+    
+    try:
+        offset = int(request.args['offset'])
+        total = int(request.args['total'])
+    except (KeyError, ValueError):
+        return jsonify({"status": "error", "message": "offset and total are required."}), 400
+    if offset < 0 or total < offset:
+        return jsonify({"status": "error", "message": "offset must be between 0 and total."}), 400
+    
+    with _receiving_lock:
+        busy = file_path in _receiving
+        if not busy:
+            _receiving.add(file_path)
+    if busy:
+        received, complete = _received(file_path)
+        return jsonify({
+            "status": "error",
+            "message": "Another chunk of this file is being received.",
+            "received": received,
+            "complete": complete
+        }), 409
+    try:
+        with staging_area.writing(upload_id):
+            return _receive_chunk(upload_id, file_path, offset, total)
+    finally:
+        with _receiving_lock:
+            _receiving.discard(file_path)
+
+def _receive_chunk(upload_id, file_path, offset, total):
+    """Append the request body to the file's .part at offset; the caller holds the file"""
+    received, complete = _received(file_path)
+    if complete or offset != received:
+        return jsonify({
+            "status": "error",
+            "message": "Chunk does not continue the file.",
+            "received": received,
+            "complete": complete
+        }), 409
+    
+    reserved = total - received
+    if request.content_length is not None:
+        reserved = min(reserved, request.content_length)
+    staging_area.reserve(upload_id, reserved)
+    
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    part_path = file_path + '.part'
+    try:
+        with open(part_path, 'ab') as f:
+            while received < total:
+                chunk = request.stream.read(min(UPLOAD_BUFFER_SIZE, total - received))
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+                reserved -= len(chunk)
+    finally:
+        # Give back what was reserved but not written
+        staging_area.adjust(upload_id, -reserved)
+    
+    if received == total:
+        os.replace(part_path, file_path)
+    
+    return jsonify({"status": "success", "received": received, "complete": received == total})
+
+@app.route('/upload/<upload_id>/dedupe', methods=['POST'])
+def dedupe_upload(upload_id):
+    """
+    Before sending its files, the client posts {"files": [{"path", "size",
+    "sha256"}, ...]} and optionally "root", the folder they are meant for.
+    A file whose content is already on the server, under root or else in
+    another upload, is hard-linked into place (copied where the filesystem
+    cannot link) instead of being sent; /upload/<upload_id>/status then
+    reports it complete. Linking is safe because organizing only ever moves
+    files, never rewrites them.
+    """
+    upload_dir = _upload_dir(upload_id)
+    if upload_dir is None:
+        return jsonify({"status": "error", "message": "Unknown upload."}), 404
+    
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    root = data.get('root')
+    if not isinstance(files, list):
+        return jsonify({"status": "error", "message": "files must be a list."}), 400
+    if root and not os.path.isdir(root):
+        return jsonify({"status": "error", "message": "Root folder does not exist."}), 400
+    
+    targets = []
+    for file in files:
+        try:
+            path, size, digest = file['path'], file['size'], file[UPLOAD_HASH_ALGORITHM].lower()
+        except (KeyError, TypeError, AttributeError):
+            return jsonify({"status": "error", "message": "Each file needs path, size and sha256."}), 400
+        file_path = safe_join(upload_dir, path) if isinstance(path, str) and path else None
+        if file_path is None or not isinstance(size, int) or size < 0:
+            return jsonify({"status": "error", "message": f"Invalid file: {path}"}), 400
+        targets.append((path, file_path, (size, digest)))
+    
+    if root:
+        roots = [root]
+    else:
+        roots = [path for other_id, path in staging_area.uploads().items() if other_id != upload_id]
+    found = {}
+    wanted = {key for _, file_path, key in targets if not os.path.exists(file_path)}
+    for folder in roots:
+        if wanted.issubset(found):
+            break
+        found.update(upload_index.find_content(folder, wanted.difference(found)))
+    
+    linked, missing = [], []
+    with staging_area.writing(upload_id):
+        for path, file_path, key in targets:
+            if os.path.exists(file_path):
+                continue
+            source = found.get(key)
+            if source is None:
+                missing.append(path)
                 continue
-                
-            # Get the relative path from the webkitRelativePath
-            relative_path = file.filename
-            
-            # Create directory structure
-            file_path = os.path.join(upload_dir, relative_path)
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            # Save the file
-            file.save(file_path)
-        
-        return jsonify({
-            "status": "success", 
-            "message": "Files uploaded successfully.",
-            "upload_path": upload_dir
-        })
-        
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Upload failed: {str(e)}"}), 500
+            try:
+                os.link(source, file_path)
+            except OSError:
+                try:
+                    shutil.copyfile(source, file_path)
+                except OSError:
+                    missing.append(path)
+                    continue
+            linked.append(path)
+    
+    if linked:
+        staging_area.refresh(upload_id)
+    return jsonify({"status": "success", "linked": linked, "missing": missing})
+
+@app.route('/upload/<upload_id>/status')
+def upload_status(upload_id):
+    file_path, error = _chunked_upload_file()
+    if error:
+        return error
+    
+    received, complete = _received(file_path)
+    return jsonify({"status": "success", "received": received, "complete": complete})
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """
+    Organize a zip or tar archive sent as the request body straight into
+    ?folder_path=, or into a new upload if none is given. Each file is
+    written once, to its final place; nothing is extracted first. The
+    folder is claimed from the job manager meanwhile, so jobs on it wait
+    for the archive to be in (409 if one is there already).
+    """
+    folder_path = request.args.get('folder_path')
+    upload_id = None
+    if folder_path and not os.path.isdir(folder_path):
+        return jsonify({"status": "error", "message": "Folder path does not exist."}), 400
+    if not folder_path:
+        upload_id = staging_area.create()
+        folder_path = staging_area.get(upload_id)
+        try:
+            staging_area.reserve(upload_id, request.content_length or 0)
+        except staging.StagingFull:
+            staging_area.remove(upload_id)
+            raise
+    
+    claim = job_manager.claim(folder_path)
+    if claim is None:
+        return jsonify({"status": "error", "message": "A job is working on this folder."}), 409
+    scratch_id = None
+    try:
+        stream = io.BufferedReader(request.stream, UPLOAD_BUFFER_SIZE)
+        with staging_area.writing(upload_id):
+            if stream.peek(4)[:4] == b'PK\x03\x04':
+                # A zip lists its members at the end, so it has to be on disk
+                # first, in an upload of its own so the quota counts it. A
+                # tar is organized as it arrives.
+                scratch_id = staging_area.create()
+                staging_area.reserve(scratch_id, request.content_length or 0)
+                archive = tempfile.TemporaryFile(dir=staging_area.get(scratch_id))
+                with staging_area.writing(scratch_id):
+                    shutil.copyfileobj(stream, archive, UPLOAD_BUFFER_SIZE)
+                archive.seek(0)
+            else:
+                archive = stream
+    
+            with archive:
+                success, messages = script_org.ingest_archive(archive, folder_path)
+    except staging.StagingFull:
+        if upload_id is not None:
+            staging_area.remove(upload_id)
+        raise
+    finally:
+        job_manager.release(claim)
+        if scratch_id is not None:
+            staging_area.remove(scratch_id)
+    if not success:
+        if upload_id is not None:
+            staging_area.remove(upload_id)
+        return jsonify({"status": "error", "message": "Could not read the archive.", "messages": messages}), 400
+    if upload_id is not None:
+        staging_area.refresh(upload_id)
+    return jsonify({
+        "status": "success",
+        "message": "Archive organized.",
+        "upload_id": upload_id, # None unless the archive went into a new upload
+        "upload_path": folder_path,
+        "messages": messages
+    })
+
+@app.route('/staging')
+def staging_metrics():
+    """Space used by uploads, against the quota and the free space on the disk"""
+    return jsonify(staging_area.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Counters and timing histograms of all runs so far (steps, operations and
+    hot helpers), plus the jobs and the staging area now, for Prometheus
+    """
+    states = job_manager.states()
+    for state in ('queued', 'running'):
+        metrics.REGISTRY.set('jobs', states.get(state, 0), state=state)
+    stats = staging_area.stats()
+    metrics.REGISTRY.set('staging_used_bytes', stats['used_bytes'])
+    metrics.REGISTRY.set('staging_quota_bytes', stats['quota_bytes'])
+    metrics.REGISTRY.set('staging_uploads', stats['uploads'])
+    metrics.REGISTRY.set('staging_disk_free_bytes', stats['disk_free_bytes'])
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/organize', methods=['POST'])
 def organize():
-    global organization_status
-    if organization_status["running"]:
-        return jsonify({"status": "error", "message": "Organization already in progress."}), 409
+    data = request.get_json()
+    folder_path = data.get('folder_path') if data else None
+    dry_run = bool(data.get('dry_run')) if data else False
+    workers = data.get('workers') if data else None
+    full_rebuild = bool(data.get('full_rebuild')) if data else False
+    profile = bool(data.get('profile')) if data else False
+    
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        return jsonify({"status": "error", "message": "workers must be a positive integer."}), 400
+    
+    if not folder_path:
+        return jsonify({"status": "error", "message": "Folder path is required."}), 400
+
+    if not os.path.exists(folder_path):
+        return jsonify({"status": "error", "message": "Folder path does not exist."}), 400
+
+    # Queue the organization; it starts as soon as its folder is free
+    job = job_manager.submit(folder_path, dry_run=dry_run, workers=workers, full_rebuild=full_rebuild,
+                             profile=profile)
+
+    if dry_run:
+        message = "Dry run started. Nothing will be changed."
+    else:
+        message = "Organization started."
+    if job.status["state"] == "queued":
+        message += " It will run once earlier jobs on this folder have finished."
+    return jsonify({"status": "success", "message": message, "job_id": job.id})
 
+@app.route('/undo', methods=['POST'])
+def undo():
+    """
+    Back out the last organization of a folder (see script_org.undo_last_run)
+    in a job, which waits for the jobs on the folder before it like any other
+    """
     data = request.get_json()
     folder_path = data.get('folder_path') if data else None
     
@@ -141,23 +464,118 @@ def organize():
     if not os.path.exists(folder_path):
         return jsonify({"status": "error", "message": "Folder path does not exist."}), 400
 
-    # Start the organization task in a separate thread
-    thread = threading.Thread(target=run_organization_task, args=(folder_path,))
-    thread.daemon = True
-    thread.start()
+    job = job_manager.submit(folder_path, undo=True)
+    message = "Undo started."
+    if job.status["state"] == "queued":
+        message += " It will run once earlier jobs on this folder have finished."
+    return jsonify({"status": "success", "message": message, "job_id": job.id})
 
-    return jsonify({"status": "success", "message": "Organization started."})
+# Polling clients pass the 'cursor' of their last status as ?cursor= to get
+# only the messages that came after it
 
 @app.route('/status')
 def status():
-    global organization_status
-    return jsonify(organization_status)
+    # Status of the most recent job, for clients that do not track job ids
+    job = job_manager.latest()
+    if job is None:
+        return jsonify(IDLE_STATUS)
+    return jsonify(job.snapshot(request.args.get('cursor', 0, type=int)))
+
+@app.route('/preview/<job_id>')
+def job_preview(job_id):
+    """
+    Plan of a finished dry run: the operations, the undo operations, a count
+    per kind and the resulting layout (see script_org.organize_files_web)
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    if job.preview is None:
+        return jsonify({"status": "error", "message": "This job has no preview (yet)."}), 404
+    return jsonify(job.preview)
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    return jsonify(job.snapshot(request.args.get('cursor', 0, type=int)))
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job: a 'progress' event with the new
+    messages and the current progress whenever something changes, then one
+    'done' event with the final status. Each event's id is its cursor, so a
+    reconnecting EventSource resumes where it left off.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('cursor', 0, type=int)
+
+    def events():
+        nonlocal cursor
+        work = None
+        while True:
+            if not job.wait(cursor, EVENT_KEEPALIVE, work):
+                yield ": keep-alive\n\n"
+                continue
+            snapshot = job.snapshot(cursor)
+            cursor = snapshot["cursor"]
+            work = snapshot["work"]
+            if snapshot["state"] == "finished":
+                yield f"id: {cursor}\nevent: done\ndata: {json.dumps(snapshot)}\n\n"
+                return
+            yield f"id: {cursor}\nevent: progress\ndata: {json.dumps(snapshot)}\n\n"
+            time.sleep(EVENT_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/download/<path:filename>')
 def download_file(filename):
-    # This would be used to download the organized files
-    # Implementation depends on your specific needs
-    pass
+    """
+    Download an upload, or one brand or product folder inside it, as a zip
+    that is made while it is sent. filename is the upload id, optionally
+    followed by the path of the folder. Single byte ranges are served, so
+    an interrupted download can resume; If-Range is checked against the
+    ETag, which changes when the folder does.
+    """
+    upload_id, _, subpath = filename.partition('/')
+    folder_path = _upload_dir(upload_id)
+    if folder_path is not None and subpath:
+        folder_path = safe_join(folder_path, subpath)
+    if folder_path is None or not os.path.isdir(folder_path):
+        return jsonify({"status": "error", "message": "Unknown folder."}), 404
+    
+    name = os.path.basename(os.path.normpath(folder_path)) if subpath else "organized"
+    archive = zipstream.ZipStream(folder_path, name=name, exclude={script_org.MANIFEST_NAME, script_org.JOURNAL_NAME})
+    headers = {
+        "Content-Disposition": f'attachment; filename="{secure_filename(name) or "organized"}.zip"',
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{archive.etag}"',
+    }
+    
+    start, stop, status = 0, archive.size, 200
+    if_range = request.if_range
+    # Several ranges at once are not served: the whole zip is sent instead,
+    # which a client has to accept
+    if (request.range is not None and len(request.range.ranges) == 1
+            and if_range.date is None and if_range.etag in (None, archive.etag)):
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{archive.size}"
+            return Response(status=416, headers=headers)
+        start, stop = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{archive.size}"
+    headers["Content-Length"] = str(stop - start)
+    
+    return Response(stream_with_context(archive.read(start, stop)), status=status,
+                    headers=headers, mimetype='application/zip', direct_passthrough=True)
 
 if __name__ == '__main__':
     app.run(debug=False)
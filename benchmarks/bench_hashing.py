@@ -0,0 +1,74 @@
+# bench_hashing.py
+"""
+Hashing throughput of get_file_hash on small JPEG-sized files and large
+MP4-sized files, for each digest, next to the old 4 KB read loop.
+
+Usage: python benchmarks/bench_hashing.py [--video-mb 512] [--images 2000]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script_org
+
+def hash_4k_loop(filepath, algorithm='md5'):
+    """get_file_hash as it was: 4 KB reads in a Python-level loop"""
+    digest = hashlib.new(algorithm)
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_files(folder, count, size):
+    paths = []
+    block = os.urandom(min(size, 1024 * 1024))
+    for i in range(count):
+        path = os.path.join(folder, f"file_{size}_{i}")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+def throughput(hash_function, paths, algorithm):
+    """MB/s over paths; the files were just written so they are in the page cache"""
+    total = sum(os.path.getsize(path) for path in paths)
+    start = time.perf_counter()
+    for path in paths:
+        hash_function(path, algorithm)
+    elapsed = time.perf_counter() - start
+    return total / (1024 * 1024) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=2000, help="number of 300 KB image files")
+    parser.add_argument('--videos', type=int, default=2, help="number of large video files")
+    parser.add_argument('--video-mb', type=int, default=256, help="size of each video file in MB")
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp(prefix="bench_hashing_")
+    try:
+        cases = [
+            ("JPEG 300 KB", write_files(folder, args.images, 300 * 1024)),
+            (f"MP4 {args.video_mb} MB", write_files(folder, args.videos, args.video_mb * 1024 * 1024)),
+        ]
+        print(f"{'files':<14}{'algorithm':<10}{'4 KB loop':>12}{'get_file_hash':>16}")
+        for label, paths in cases:
+            for algorithm in ('md5', 'sha1', 'blake2b'):
+                old = throughput(hash_4k_loop, paths, algorithm)
+                new = throughput(script_org.get_file_hash, paths, algorithm)
+                print(f"{label:<14}{algorithm:<10}{old:>9.0f} MB/s{new:>13.0f} MB/s")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+# bench_organize.py
+"""
+Time organize_files_web on a generated catalog, step by step, and save the
+results as JSON.
+
+Each full run organizes a freshly generated catalog (see catalog.py). The
+report has the time spent planning and applying each step, files per
+second, the file system calls made and the peak memory of the run, and the
+same for a run on the already organized catalog (the manifest path) and
+for a dry run. With --baseline the results are compared with an earlier
+results file, and the exit status is 1 if anything got worse by more than
+--tolerance.
+
+Usage: python benchmarks/bench_organize.py [--brands 20] [--products 50] [--repeat 3]
+                                           [--output results.json] [--baseline old.json]
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog
+import script_org
+
+# The step functions _organize_steps calls, and the step each one plans;
+# organize_folder_contents plans step 2 for the WEBP folder and 5 otherwise
+STEP_FUNCTIONS = {
+    'flatten_nested_folders': 1,
+    'move_webp_folders_to_main': 3,
+    'organize_files_in_brand_folders': 4,
+    'organize_folder_contents': 5,
+    'remove_empty_folders': 6,
+}
+
+# Other parts of a run that are timed on their own
+PHASE_FUNCTIONS = {
+    'load_manifest': 'manifest',
+    '_settled_folders': 'manifest',
+    '_update_manifest': 'manifest',
+}
+
+class _Calls:
+    """
+    Counts file system calls while active: the ones that raise audit events
+    (open, os.scandir, os.rename, os.mkdir, ...) and os.stat/os.lstat,
+    which raise none and are counted by wrapping them. DirEntry.stat is not
+    seen; on Linux it is a stat call of its own.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.active = False
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if self.active and (event == 'open' or event.startswith('os.')):
+            self.counts[event] += 1
+
+    def _counting(self, name, function):
+        def counted(*args, **kwargs):
+            if self.active:
+                self.counts[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        self.counts = collections.Counter()
+        self._saved = os.stat, os.lstat
+        os.stat = self._counting('os.stat', os.stat)
+        os.lstat = self._counting('os.lstat', os.lstat)
+        self.active = True
+        return self
+
+    def __exit__(self, *exc):
+        self.active = False
+        os.stat, os.lstat = self._saved
+
+class _StepTimer:
+    """
+    Times the planning of each step and the applying of its operations by
+    wrapping the script_org functions that do them, for the length of a run
+    """
+
+    def __init__(self):
+        self.planning = collections.Counter() # step -> seconds
+        self.applying = collections.Counter() # step -> seconds
+        self.phases = collections.Counter() # phase -> seconds
+        self.operations = collections.Counter() # step -> operations applied
+        self._step_of = {} # id(operation) -> step
+        self._saved = {}
+
+    def _wrap(self, name, record):
+        function = getattr(script_org, name)
+        self._saved[name] = function
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(args, kwargs, time.perf_counter() - start)
+        setattr(script_org, name, timed)
+
+    def __enter__(self):
+        for name, step in STEP_FUNCTIONS.items():
+            def plan(args, kwargs, seconds, step=step):
+                if step == 5 and kwargs.get('is_webp_folder'):
+                    step = 2
+                self.planning[step] += seconds
+            self._wrap(name, plan)
+        for name, phase in PHASE_FUNCTIONS.items():
+            self._wrap(name, lambda args, kwargs, seconds, phase=phase: self.phases.__setitem__(
+                phase, self.phases[phase] + seconds))
+
+        plan_run = script_org._plan_run
+        self._saved['_plan_run'] = plan_run
+
+        def planned(*args, **kwargs):
+            start = time.perf_counter()
+            operations, view, steps = plan_run(*args, **kwargs)
+            self.phases['planning'] += time.perf_counter() - start
+            bounds = steps + [(None, len(operations))]
+            for (step, first), (_, last) in zip(bounds, bounds[1:]):
+                for op in operations[first:last]:
+                    self._step_of[id(op)] = step
+            return operations, view, steps
+        script_org._plan_run = planned
+
+        def applied(args, kwargs, seconds):
+            step = self._step_of.get(id(args[0]))
+            self.applying[step] += seconds
+            self.operations[step] += 1
+        self._wrap('_apply_operation', applied)
+        self._wrap('execute_plan', lambda args, kwargs, seconds: self.phases.__setitem__(
+            'applying', self.phases['applying'] + seconds))
+        return self
+
+    def __exit__(self, *exc):
+        for name, function in self._saved.items():
+            setattr(script_org, name, function)
+
+    def steps(self):
+        """Per-step results, in step order"""
+        return {str(step): {
+                    'title': script_org.STEP_TITLES[step],
+                    'planning_seconds': round(self.planning[step], 4),
+                    'applying_seconds': round(self.applying[step], 4),
+                    'operations': self.operations[step],
+                } for step in sorted(set(self.planning) | set(self.applying)) if step is not None}
+
+def run_once(folder, calls, dry_run=False, workers=None, memory=False):
+    """Organize folder once and return the measurements of the run"""
+    reports = []
+    if memory:
+        tracemalloc.start()
+    try:
+        with _StepTimer() as timer, calls:
+            start = time.perf_counter()
+            result = script_org.organize_files_web(folder, dry_run=dry_run, workers=workers,
+                                                   progress=lambda message: None,
+                                                   on_progress=reports.append)
+            elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    work = reports[-1] if reports else {}
+    files = work.get('files') or 0
+    run = {
+        'success': result[0],
+        'seconds': round(elapsed, 4),
+        'files': files,
+        'files_per_sec': round(files / elapsed, 1) if elapsed else None,
+        'operations': work.get('total', 0),
+        'failed': work.get('failed', 0),
+        'bytes': work.get('bytes_total', 0),
+        'phases': {phase: round(seconds, 4) for phase, seconds in sorted(timer.phases.items())},
+        'steps': timer.steps(),
+        'syscalls': dict(sorted(calls.counts.items())),
+        'syscalls_total': sum(calls.counts.values()),
+    }
+    if memory:
+        run['peak_memory_bytes'] = peak
+    return run
+
+def _median_run(runs):
+    return sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+
+def benchmark(options, repeat=3, workers=None, memory=True):
+    """Generate catalogs, organize them and return the results"""
+    calls = _Calls()
+    folder = tempfile.mkdtemp(prefix="bench_organize_")
+    try:
+        results = {'catalog': None, 'full': [], 'rerun': None, 'dry_run': None}
+        for index in range(repeat):
+            root = os.path.join(folder, f"catalog_{index}")
+            results['catalog'] = catalog.generate_catalog(root, **options)
+            results['full'].append(run_once(root, calls, workers=workers))
+        # The last catalog is organized now, and has a manifest
+        results['rerun'] = run_once(root, calls, workers=workers)
+
+        root = os.path.join(folder, "catalog_dry_run")
+        catalog.generate_catalog(root, **options)
+        results['dry_run'] = run_once(root, calls, dry_run=True)
+
+        if memory:
+            # A run of its own: tracing allocations slows everything down
+            root = os.path.join(folder, "catalog_memory")
+            catalog.generate_catalog(root, **options)
+            results['memory'] = run_once(root, calls, workers=workers, memory=True)
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def summarize(results):
+    """The numbers a regression is judged by; for all of them but files_per_sec, lower is better"""
+    full = _median_run(results['full'])
+    summary = {
+        'full_seconds': full['seconds'],
+        'files_per_sec': full['files_per_sec'],
+        'full_syscalls': full['syscalls_total'],
+        'rerun_seconds': results['rerun']['seconds'],
+        'rerun_syscalls': results['rerun']['syscalls_total'],
+        'dry_run_seconds': results['dry_run']['seconds'],
+    }
+    for step, numbers in full['steps'].items():
+        summary[f'step{step}_seconds'] = round(numbers['planning_seconds'] + numbers['applying_seconds'], 4)
+    if 'memory' in results:
+        summary['peak_memory_bytes'] = results['memory']['peak_memory_bytes']
+    return summary
+
+def compare(summary, baseline, tolerance):
+    """Print summary next to baseline; returns the names of the numbers that got worse"""
+    worse = []
+    print(f"\n{'':<22}{'baseline':>14}{'now':>14}{'change':>10}")
+    for name, value in summary.items():
+        old = baseline.get(name)
+        if not old or value is None:
+            continue
+        change = value / old - 1
+        regressed = -change > tolerance if name == 'files_per_sec' else change > tolerance
+        if regressed:
+            worse.append(name)
+        print(f"{name:<22}{old:>14}{value:>14}{change:>+9.0%}{'  worse' if regressed else ''}")
+    return worse
+
+def print_results(results, summary):
+    full = _median_run(results['full'])
+    files = full['files']
+    print(f"{results['catalog']['files']} files generated, {files} organized "
+          f"in {full['seconds']:.2f} s ({full['files_per_sec']:.0f} files/s, median of {len(results['full'])})")
+    print(f"\n{'step':<44}{'planning':>10}{'applying':>10}{'ops':>8}")
+    for step, numbers in full['steps'].items():
+        print(f"{step + ' ' + numbers['title']:<44}{numbers['planning_seconds']:>9.3f}s"
+              f"{numbers['applying_seconds']:>9.3f}s{numbers['operations']:>8}")
+    for phase, seconds in full['phases'].items():
+        print(f"{phase:<44}{seconds:>9.3f}s")
+    print(f"\nfile system calls: {full['syscalls_total']} "
+          f"({', '.join(f'{name} {count}' for name, count in full['syscalls'].items())})")
+    print(f"rerun on the organized catalog: {summary['rerun_seconds']:.3f} s, "
+          f"{summary['rerun_syscalls']} file system calls")
+    print(f"dry run: {summary['dry_run_seconds']:.3f} s")
+    if 'peak_memory_bytes' in summary:
+        print(f"peak memory: {summary['peak_memory_bytes'] / (1024 * 1024):.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    catalog.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help="full runs; the median is reported")
+    parser.add_argument('--workers', type=int, default=None, help="threads applying each plan")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory run")
+    parser.add_argument('--output', default='bench_organize.json', help="where to save the results")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="how much worse than the baseline a number may get (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    script_org.set_log_level('WARNING')
+    results = benchmark(catalog.catalog_options(args), repeat=max(1, args.repeat),
+                        workers=args.workers, memory=not args.no_memory)
+    summary = summarize(results)
+    print_results(results, summary)
+
+    document = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {'repeat': args.repeat, 'workers': args.workers},
+        'catalog': results['catalog'],
+        'summary': summary,
+        'runs': {name: results[name] for name in ('full', 'rerun', 'dry_run', 'memory') if name in results},
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('catalog') != results['catalog']:
+            print("\nWarning: the baseline was measured on a different catalog")
+        worse = compare(summary, baseline['summary'], args.tolerance)
+        if worse:
+            print(f"\nWorse than the baseline by more than {args.tolerance:.0%}: {', '.join(worse)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
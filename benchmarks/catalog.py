@@ -0,0 +1,167 @@
+# catalog.py
+"""
+Synthetic product catalogs for the organizer benchmarks: brand folders with
+loose and already organized product images, a WEBP drop folder, nested
+same-name folders, duplicates and conflicting files.
+
+Usage: python benchmarks/catalog.py FOLDER [--brands 20] [--products 50] ...
+"""
+
+import argparse
+import json
+import os
+import random
+
+WEBP_FOLDER = '__WEBP to be move to the right folders'
+
+# Extensions the files of one variant cycle through
+EXTENSIONS = ['.jpg', '.webp', '.mp4', '.png', '.JPG', '.jpeg']
+
+# Suffixes that mark the variants of a product, as photographers write them
+VARIANTS = ['', '-a', '-b', '_1', ' c', '-d', '_2', ' e']
+
+CATEGORY_FOLDERS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP', '.mp4': 'Videos'}
+
+_SYLLABLES = ['ac', 'me', 'no', 'va', 'bo', 'lt', 'ze', 'ta', 'hy', 'per', 'ko', 'ri',
+              'lu', 'mi', 'sa', 'tor', 'en', 'dal', 'qu', 'ix']
+
+def brand_names(count, rng):
+    """count distinct brand names; about one in eight has two words"""
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        if rng.random() < 0.125:
+            name += ' ' + rng.choice(['Co', 'Pro', 'Labs', 'Gear'])
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _content(name, size):
+    """Bytes of a file: its name, padded to size, so files differ unless meant to be duplicates"""
+    data = name.encode('utf-8')
+    return (data * (size // max(1, len(data)) + 1))[:max(size, len(data))]
+
+def generate_catalog(root, brands=20, products=50, variants=3, files=2, file_size=4096,
+                     organized=0.3, webp=0.2, webp_brands=2, nested=3, duplicates=20,
+                     conflicts=20, seed=0):
+    """
+    Write a catalog under root and return what it holds.
+
+    Every brand gets products product codes with variants variants each, and
+    every variant files files of different formats (see EXTENSIONS). A share
+    organized of the products is already in Brand/Code/Category folders;
+    the rest lie loose in the brand folder, except that a share webp of the
+    WEBP files waits in the WEBP drop folder, under brand folders spelled a
+    little differently, next to webp_brands brands that only exist there.
+
+    nested brands have their loose files in same-name folders two levels
+    down (Brand/Brand/Brand). duplicates files of the drop folder are also
+    at their destination with the same content, and conflicts files with
+    the same name but other content, which the organizer moves to Old Images.
+    """
+    rng = random.Random(seed)
+    counts = {'files': 0, 'bytes': 0, 'duplicates': 0, 'conflicts': 0}
+
+    def write(path, data):
+        _write(path, data)
+        counts['files'] += 1
+        counts['bytes'] += len(data)
+
+    names = brand_names(brands + webp_brands, rng)
+    own_brands, webp_only = names[:brands], names[brands:]
+    webp_root = os.path.join(root, WEBP_FOLDER)
+    os.makedirs(root, exist_ok=True)
+    dropped = [] # (brand, product code, file name, content) in the WEBP drop folder
+
+    for index, brand in enumerate(own_brands):
+        brand_folder = os.path.join(root, brand)
+        loose_folder = brand_folder
+        if index < nested:
+            loose_folder = os.path.join(brand_folder, brand, brand)
+        prefix = rng.choice(['X', 'Q', 'RT', 'K', 'M'])
+        for number in range(products):
+            code = f"{prefix}{100 + number}"
+            settled = rng.random() < organized
+            for variant in VARIANTS[:variants]:
+                for extension in EXTENSIONS[:files]:
+                    file = f"{brand.replace(' ', rng.choice([' ', '-']))}-{code}{variant}{extension}"
+                    data = _content(file, file_size)
+                    if settled:
+                        category = CATEGORY_FOLDERS.get(extension.lower())
+                        folder = os.path.join(brand_folder, code, *([category] if category else []))
+                        write(os.path.join(folder, file), data)
+                    elif extension == '.webp' and rng.random() < webp:
+                        dropped.append((brand, code, file, data))
+                    else:
+                        write(os.path.join(loose_folder, file), data)
+        # Camera files the organizer keeps in Unedited folders
+        for _ in range(max(1, products // 10)):
+            file = f"IMG_{rng.randint(1000, 9999)}.jpg"
+            write(os.path.join(brand_folder, file), _content(brand + file, file_size))
+
+    for brand in webp_only:
+        for number in range(max(1, products // 5)):
+            file = f"{brand}-W{100 + number}.webp"
+            dropped.append((brand, f"W{100 + number}", file, _content(file, file_size)))
+
+    for brand, code, file, data in dropped:
+        # The drop folder spells brands its own way
+        spelling = rng.choice([brand, brand.lower(), brand.replace(' ', '-')])
+        write(os.path.join(webp_root, spelling, file), data)
+
+    # Duplicates and conflicts: the file is also where the WEBP folder will
+    # put it, with the same or with other content
+    for brand, code, file, data in rng.sample(dropped, min(len(dropped), duplicates + conflicts)):
+        if brand in webp_only:
+            continue
+        if counts['duplicates'] < duplicates:
+            counts['duplicates'] += 1
+        else:
+            counts['conflicts'] += 1
+            data = _content('conflict ' + file, len(data))
+        write(os.path.join(root, brand, code, 'WEBP', file), data)
+
+    counts.update(brands=brands, products=products, variants=variants, files_per_variant=files,
+                  file_size=file_size, webp_files=len(dropped), nested=min(nested, brands), seed=seed)
+    return counts
+
+def add_arguments(parser):
+    """The catalog options, shared with the benchmarks that generate catalogs"""
+    parser.add_argument('--brands', type=int, default=20, help="number of brands")
+    parser.add_argument('--products', type=int, default=50, help="product codes per brand")
+    parser.add_argument('--variants', type=int, default=3, choices=range(1, len(VARIANTS) + 1),
+                        metavar='N', help="variants per product")
+    parser.add_argument('--files', type=int, default=2, choices=range(1, len(EXTENSIONS) + 1),
+                        metavar='N', help="files (formats) per variant")
+    parser.add_argument('--file-kb', type=int, default=4, help="size of each file in KB")
+    parser.add_argument('--organized', type=float, default=0.3, help="share of products already organized")
+    parser.add_argument('--webp', type=float, default=0.2, help="share of WEBP files in the WEBP drop folder")
+    parser.add_argument('--webp-brands', type=int, default=2, help="brands only in the WEBP drop folder")
+    parser.add_argument('--nested', type=int, default=3, help="brands with nested same-name folders")
+    parser.add_argument('--duplicates', type=int, default=20, help="WEBP files already at their destination")
+    parser.add_argument('--conflicts', type=int, default=20, help="WEBP files whose destination holds other content")
+    parser.add_argument('--seed', type=int, default=0, help="random seed; the same seed gives the same catalog")
+
+def catalog_options(args):
+    """generate_catalog keyword arguments from parsed add_arguments options"""
+    return dict(brands=args.brands, products=args.products, variants=args.variants, files=args.files,
+                file_size=args.file_kb * 1024, organized=args.organized, webp=args.webp,
+                webp_brands=args.webp_brands, nested=args.nested, duplicates=args.duplicates,
+                conflicts=args.conflicts, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('folder', help="where to write the catalog")
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(generate_catalog(args.folder, **catalog_options(args)), indent=2))
+
+if __name__ == '__main__':
+    main()
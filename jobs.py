@@ -0,0 +1,338 @@
+# jobs.py
+import cProfile
+import io
+import itertools
+import multiprocessing
+import os
+import pstats
+import queue
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+import script_org
+
+# Functions listed in a job's profile, by cumulative time
+PROFILE_LINES = 40
+
+def _organize(folder_path, on_profile=None, **options):
+    """
+    organize_files_web, under cProfile if on_profile is given, which is then
+    called with the report. Only this thread is profiled, not the threads
+    that apply a plan with workers > 1.
+    """
+    if on_profile is None:
+        return script_org.organize_files_web(folder_path, **options)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(script_org.organize_files_web, folder_path, **options)
+    finally:
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        on_profile(report.getvalue())
+
+def _organize_in_process(folder_path, options, progress_queue, log_level, profile):
+    """
+    Run organize_files_web in a worker process, sending its messages (str),
+    progress reports (dict), and ('metrics', snapshot) and ('profile',
+    report) pairs back over progress_queue
+    """
+    script_org.set_log_level(log_level)
+    run_metrics = metrics.Metrics()
+    on_profile = (lambda report: progress_queue.put(('profile', report))) if profile else None
+    try:
+        return _organize(folder_path, on_profile=on_profile, progress=progress_queue.put,
+                         on_progress=progress_queue.put, metrics=run_metrics, **options)
+    finally:
+        progress_queue.put(('metrics', run_metrics.snapshot()))
+
+def _record_metrics(snapshot, run_metrics=None):
+    metrics.REGISTRY.merge(snapshot)
+    if run_metrics is not None:
+        run_metrics.merge(snapshot)
+
+class Job:
+    """
+    One organization run, or with undo=True the backing out of the last run
+    on the folder (see script_org.undo_last_run), and the status
+    /status/<job_id> reports for it
+    """
+
+    def __init__(self, folder_path, dry_run=False, workers=None, full_rebuild=False, profile=False, undo=False):
+        self.id = uuid.uuid4().hex
+        self.folder_path = folder_path
+        self.root = os.path.realpath(folder_path)
+        self.dry_run = dry_run
+        self.workers = workers
+        self.full_rebuild = full_rebuild
+        self.profile = profile
+        self.undo = undo
+        # Planned operations and resulting layout of a dry run, once it has
+        # finished. Kept out of the status, which is sent on every poll.
+        self.preview = None
+        # Counters and timings of this job's run alone
+        self.metrics = metrics.Metrics()
+        # Most recent messages, and how many there have been in all. A
+        # message's cursor is its position in the whole run, so clients can
+        # ask for what came after the last one they saw.
+        self._messages = deque(maxlen=script_org.MAX_PROGRESS_MESSAGES)
+        self._message_count = 0
+        # Notified whenever there are new messages or the job finishes
+        self._changed = threading.Condition()
+        self.status = {
+            "job_id": self.id,
+            "folder_path": folder_path,
+            "state": "queued", # queued, running or finished
+            "running": False,
+            "progress": 0, # Percentage
+            "error": None,
+            "completed": False,
+            "current_step": "Waiting to start...",
+            "work": None, # Latest script_org.PlanProgress report
+            "dry_run": dry_run,
+            "undo": undo,
+            "has_preview": False, # Whether /preview/<job_id> has the plan of a finished dry run
+            "metrics": None, # metrics.Metrics snapshot of the run, once it has finished
+            "profile": None # cProfile report of the run, if profile was asked for
+        }
+
+    def overlaps(self, other):
+        """Whether both jobs work on the same folder, or one inside the other"""
+        return (self.root == other.root
+                or self.root.startswith(other.root + os.sep)
+                or other.root.startswith(self.root + os.sep))
+
+    def snapshot(self, cursor=0):
+        """
+        Copy of the status that is safe to serialize while the job runs, with
+        the messages after cursor and the cursor to pass next time.
+        """
+        with self._changed:
+            first = self._message_count - len(self._messages)
+            messages = list(itertools.islice(self._messages, max(0, cursor - first), None))
+            return dict(self.status, messages=messages, cursor=self._message_count)
+
+    def wait(self, cursor, timeout, work=None):
+        """
+        Wait until there are messages after cursor, the job has finished or
+        there is a newer progress report than work (from an earlier snapshot)
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: (self._message_count > cursor or self.status["state"] == "finished"
+                         or self.status["work"] is not work), timeout)
+
+    def _add_message(self, message):
+        with self._changed:
+            self._messages.append(message)
+            self._message_count += 1
+            self._changed.notify_all()
+
+    def _report_work(self, work):
+        # Planning is quick next to applying the plan, so the percentage is
+        # the share of planned operations applied
+        status = self.status
+        with self._changed:
+            if work["phase"] == "planning":
+                status["current_step"] = "Planning..."
+            elif work["phase"] == "applying":
+                if work["total"]:
+                    status["progress"] = min(99, 100 * work["done"] // work["total"])
+                if work["step"] is not None:
+                    status["current_step"] = (f"Step {work['step']}: {work['step_title']} "
+                                              f"({work['step_done']}/{work['step_total']})")
+            status["work"] = work
+            self._changed.notify_all()
+
+    def _report_profile(self, report):
+        self.status["profile"] = report
+    
+    def run(self, organize=_organize):
+        """
+        Run the job with organize, which is called like organize_files_web,
+        plus on_profile when the job is profiled (see _organize). An undo
+        only moves files back, so it runs in this thread in any case.
+        """
+        status = self.status
+        status["state"] = "running"
+        status["running"] = True
+        status["current_step"] = "Undoing the last run..." if self.undo else "Starting organization..."
+        options = dict(full_rebuild=self.full_rebuild, progress=self._add_message,
+                       on_progress=self._report_work, metrics=self.metrics)
+        if self.profile:
+            options["on_profile"] = self._report_profile
+
+        # Every message reaches the status through progress as it is logged,
+        # so the list organize returns is not needed
+        try:
+            if self.undo:
+                with metrics.recording(self.metrics):
+                    success, _ = script_org.undo_last_run(self.folder_path, progress=self._add_message,
+                                                         workers=self.workers)
+            elif self.dry_run:
+                success, _, preview = organize(self.folder_path, dry_run=True, **options)
+                self.preview = preview
+                status["has_preview"] = preview is not None
+            else:
+                success, _ = organize(self.folder_path, workers=self.workers, **options)
+            status["completed"] = True
+            status["progress"] = 100
+            status["current_step"] = "Undo completed!" if self.undo else "Organization completed!"
+
+            if not success:
+                status["error"] = ("Undo failed. Check logs for details." if self.undo
+                                   else "Organization failed. Check logs for details.")
+        except Exception as e:
+            status["error"] = str(e)
+            self._add_message(f"An unexpected error occurred: {e}")
+            status["completed"] = True
+            status["progress"] = 100
+            status["current_step"] = "Error occurred"
+        finally:
+            with self._changed:
+                status["metrics"] = self.metrics.snapshot()
+                status["running"] = False
+                status["state"] = "finished"
+                self._changed.notify_all()
+
+class JobManager:
+    """
+    Runs organization jobs on a bounded pool of threads. Jobs on folders that
+    overlap run one after the other, in the order they were submitted; all
+    others run side by side.
+    
+    With processes=True each job runs in a pool of worker processes instead,
+    so parsing and planning use other cores and do not hold this process's
+    GIL. The job's thread then only relays messages from a queue.
+    """
+
+    def __init__(self, max_workers=4, max_finished=100, processes=False):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.processes = processes
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='organize')
+        self._process_pool = None
+        self._queue_manager = None
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict() # job id -> Job, oldest first
+        self._waiting = [] # Jobs not handed to the pool yet, in order
+        self._active = [] # Jobs handed to the pool and not finished
+
+    def submit(self, folder_path, **options):
+        """Queue a run of organize_files_web on folder_path; returns its Job"""
+        job = Job(folder_path, **options)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._waiting.append(job)
+            self._dispatch()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def busy(self, folder_path):
+        """Whether a queued or running job works on folder_path, or a folder that overlaps it"""
+        root = os.path.realpath(folder_path)
+        with self._lock:
+            return any(job.root == root or job.root.startswith(root + os.sep)
+                       or root.startswith(job.root + os.sep)
+                       for job in self._waiting + self._active)
+
+    def claim(self, folder_path):
+        """
+        Count folder_path as worked on by work done outside a job, such as an
+        archive organized as its request arrives: jobs submitted on an
+        overlapping folder wait until release. Returns the Job standing for
+        the work, to pass to release, or None if a queued or running job
+        overlaps the folder already.
+        """
+        job = Job(folder_path)
+        job.status.update(state="running", running=True)
+        with self._lock:
+            if any(job.overlaps(other) for other in self._waiting + self._active):
+                return None
+            self._active.append(job)
+        return job
+    
+    def release(self, job):
+        """End the work of a claim; jobs waiting for its folder may start"""
+        with self._lock:
+            self._active.remove(job)
+            self._dispatch()
+    
+    def states(self):
+        """Number of known jobs in each state (queued, running, finished)"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        states = {}
+        for job in jobs:
+            states[job.status["state"]] = states.get(job.status["state"], 0) + 1
+        return states
+    
+    def latest(self):
+        """The most recently submitted job, or None"""
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def _dispatch(self):
+        # A job starts once no running job and no job queued before it
+        # overlaps its folder
+        blocking = list(self._active)
+        for job in list(self._waiting):
+            if not any(job.overlaps(other) for other in blocking):
+                self._waiting.remove(job)
+                self._active.append(job)
+                self._pool.submit(self._run, job)
+            blocking.append(job)
+
+    def _organize_in_process(self, folder_path, progress, on_progress=None, metrics=None, on_profile=None,
+                             **options):
+        with self._lock:
+            if self._process_pool is None:
+                # spawn, not fork: this process has threads of its own
+                context = multiprocessing.get_context('spawn')
+                self._queue_manager = context.Manager()
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        
+        progress_queue = self._queue_manager.Queue()
+        future = self._process_pool.submit(_organize_in_process, folder_path, options, progress_queue,
+                                           script_org.logger.level, on_profile is not None)
+        while True:
+            try:
+                item = progress_queue.get(timeout=0.2)
+            except queue.Empty:
+                # Messages are queued before the run returns, so once it is
+                # done and the queue is empty nothing more will arrive
+                if future.done():
+                    break
+                continue
+            if isinstance(item, dict):
+                if on_progress is not None:
+                    on_progress(item)
+            elif isinstance(item, tuple):
+                kind, value = item
+                if kind == 'metrics':
+                    # Recorded in the worker, so this process's registry
+                    # only learns of them here
+                    _record_metrics(value, metrics)
+                elif on_profile is not None:
+                    on_profile(value)
+            else:
+                progress(item)
+        return future.result()
+
+    def _run(self, job):
+        try:
+            job.run(self._organize_in_process if self.processes else _organize)
+        finally:
+            with self._lock:
+                self._active.remove(job)
+                self._forget_finished()
+                self._dispatch()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status["state"] == "finished"]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
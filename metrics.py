@@ -0,0 +1,206 @@
+# metrics.py
+"""
+Counters, gauges and timing histograms for the organizer, rendered in the
+Prometheus text format.
+
+REGISTRY holds everything measured in this process. A run can record into
+a Metrics of its own instead (see recording), which is how a job reports
+the numbers of its run alone; they are added to REGISTRY when the run is
+over. Recording is thread-safe and cheap: a lock and a few dictionary
+updates, into one Metrics.
+"""
+
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the histogram buckets. They span a parser
+# cache hit (microseconds) to a whole run on a large share (minutes).
+BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10, 60, 600)
+
+# Set ORGANIZER_METRICS=0 to record nothing
+enabled = os.environ.get('ORGANIZER_METRICS', '1') != '0'
+
+# Metrics of the run going on in this context, recorded into instead of REGISTRY
+_recording = contextvars.ContextVar('metrics_recording', default=None)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _series(name, labels):
+    """'name{a="1",b="2"}', the key of one series of a metric"""
+    if not labels:
+        return name
+    return _labelled(name, tuple(sorted(labels.items())))
+
+@functools.lru_cache(maxsize=4096)
+def _labelled(name, labels):
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _split(series):
+    """(name, labels text without braces) of a series key"""
+    name, _, labels = series.partition('{')
+    return name, labels[:-1]
+
+class Metrics:
+    """
+    Counters, gauges and histograms by series (a name and its labels).
+
+    Counter names end in _total and histogram names in _seconds, as
+    Prometheus expects. snapshot() is a plain dict that can be sent to
+    another process or saved as JSON, and merge() adds one in.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {} # series -> value
+        self._gauges = {} # series -> value
+        self._histograms = {} # series -> [count, sum, count per bucket..., count over the last bucket]
+
+    def inc(self, name, amount=1, **labels):
+        self._add(_series(name, labels), amount)
+
+    def _add(self, series, amount):
+        with self._lock:
+            self._counters[series] = self._counters.get(series, 0) + amount
+
+    def set(self, name, value, **labels):
+        series = _series(name, labels)
+        with self._lock:
+            self._gauges[series] = value
+
+    def observe(self, name, seconds, **labels):
+        self._observe(_series(name, labels), seconds)
+
+    def _observe(self, series, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(series)
+            if histogram is None:
+                histogram = self._histograms[series] = [0, 0.0] + [0] * (len(self.buckets) + 1)
+            histogram[0] += 1
+            histogram[1] += seconds
+            histogram[2 + bucket] += 1
+
+    def snapshot(self):
+        """
+        {'counters': {series: value}, 'gauges': {series: value},
+        'histograms': {series: {'count', 'sum', 'buckets': {upper bound: cumulative count}}}}
+        """
+        with self._lock:
+            histograms = {series: list(histogram) for series, histogram in self._histograms.items()}
+            snapshot = {'counters': dict(self._counters), 'gauges': dict(self._gauges)}
+        snapshot['histograms'] = {}
+        for series, histogram in histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets, histogram[2:]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            snapshot['histograms'][series] = {'count': histogram[0], 'sum': round(histogram[1], 6),
+                                              'buckets': buckets}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the counters and histograms of a snapshot (of the same buckets) and take its gauges"""
+        with self._lock:
+            for series, value in snapshot['counters'].items():
+                self._counters[series] = self._counters.get(series, 0) + value
+            self._gauges.update(snapshot['gauges'])
+            for series, other in snapshot['histograms'].items():
+                histogram = self._histograms.get(series)
+                if histogram is None:
+                    histogram = self._histograms[series] = [0, 0.0] + [0] * (len(self.buckets) + 1)
+                histogram[0] += other['count']
+                histogram[1] += other['sum']
+                below = 0
+                for index, bound in enumerate(self.buckets):
+                    cumulative = other['buckets'].get(str(bound), below)
+                    histogram[2 + index] += cumulative - below
+                    below = cumulative
+                histogram[-1] += other['count'] - below
+
+    def render(self, prefix='organizer_'):
+        """The metrics in the Prometheus text exposition format, names prefixed with prefix"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for series, value in sorted(snapshot['counters'].items()):
+            declare(_split(series)[0], 'counter')
+            lines.append(f"{prefix}{series} {value}")
+        for series, value in sorted(snapshot['gauges'].items()):
+            declare(_split(series)[0], 'gauge')
+            lines.append(f"{prefix}{series} {value}")
+        for series, histogram in sorted(snapshot['histograms'].items()):
+            name, labels = _split(series)
+            declare(name, 'histogram')
+            labels = labels + ',' if labels else ''
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{prefix}{name}_bucket{{{labels}le="{bound}"}} {count}')
+            lines.append(f'{prefix}{name}_bucket{{{labels}le="+Inf"}} {histogram["count"]}')
+            suffix = '{' + labels[:-1] + '}' if labels else ''
+            lines.append(f"{prefix}{name}_sum{suffix} {histogram['sum']}")
+            lines.append(f"{prefix}{name}_count{suffix} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Metrics()
+
+@contextmanager
+def recording(metrics):
+    """
+    Record what is measured in this context into metrics, and add it all to
+    REGISTRY at the end
+    """
+    token = _recording.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _recording.reset(token)
+        REGISTRY.merge(metrics.snapshot())
+
+def inc(name, amount=1, **labels):
+    """Add amount to a counter of the Metrics being recorded into, or REGISTRY"""
+    if enabled:
+        (_recording.get() or REGISTRY)._add(_series(name, labels), amount)
+
+def observe(name, seconds, **labels):
+    """Record a duration in a histogram of the Metrics being recorded into, or REGISTRY"""
+    if enabled:
+        (_recording.get() or REGISTRY)._observe(_series(name, labels), seconds)
+
+@contextmanager
+def timer(name, **labels):
+    """Time the body of a with statement into histogram name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def timed(name, **labels):
+    """Decorator that times every call of a function into histogram name"""
+    series = _series(name, labels)
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                (_recording.get() or REGISTRY)._observe(series, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -1,21 +1,133 @@
 # b-up.py (modified for web integration)
 
 import os
+import errno
 import shutil
 import re
 from datetime import datetime
-import filecmp
+import functools
 import hashlib
+import json
+import posixpath
+import tarfile
+import zipfile
+import contextvars
+import logging
+import threading
+import time
+from concurrent import futures
+from collections import deque, namedtuple
+from contextlib import contextmanager
 
-# Assume a global or passed-in logger/progress reporter
-# For simplicity, we'll use a list to store messages for now.
-# In a real app, this would be more sophisticated (e.g., WebSocket).
-_progress_messages = []
+import metrics
 
-def _log_progress(message):
-    global _progress_messages
-    _progress_messages.append(message)
-    print(message) # Keep print for server-side console logging
+# Progress is reported through this logger. Its level decides what is
+# produced at all: DEBUG messages are neither formatted nor stored unless
+# the level is DEBUG (set ORGANIZER_LOG_LEVEL or call set_log_level).
+logger = logging.getLogger('script_org')
+logger.setLevel(os.environ.get('ORGANIZER_LOG_LEVEL', 'INFO').upper())
+logger.propagate = False
+
+# Messages kept per run, oldest dropped first
+MAX_PROGRESS_MESSAGES = 10000
+
+# Runs may go on in several threads at once, so their state lives in
+# context variables. _current_organizer is the Organizer of the current run
+# (see _organizer); _run_listeners holds the (callback, level) pairs that
+# receive its messages; _active_plan holds the plan being built (see
+# plan_organization): the view of the tree and the operations planned so far;
+# _plan_progress counts the work of the plan being applied (see PlanProgress);
+# _run_journal records the operations applied (see Journal).
+_current_organizer = contextvars.ContextVar('current_organizer', default=None)
+_run_listeners = contextvars.ContextVar('run_listeners', default=())
+_active_plan = contextvars.ContextVar('active_plan', default=(None, None))
+_plan_progress = contextvars.ContextVar('plan_progress', default=None)
+_run_journal = contextvars.ContextVar('run_journal', default=None)
+
+# One step of a plan. kind is 'mkdir' (dst), 'move' or 'archive' (src -> dst;
+# archive moves a file aside into Old Images), 'rmdir' (src) or 'extract'
+# (archive member src -> dst, see ingest_archive). message is
+# logged once the operation has been applied. size is the number of bytes
+# a move or archive carries: the file, or every file inside the folder.
+Operation = namedtuple('Operation', ['kind', 'src', 'dst', 'message', 'size'], defaults=(None, None))
+
+# The steps of an organization run, by number
+STEP_TITLES = {
+    1: "Flattening nested folders",
+    2: "Organizing WEBP folder contents",
+    3: "Moving WEBP folders to main structure",
+    4: "Organizing files in brand folders",
+    5: "Organizing remaining folder contents",
+    6: "Removing empty folders",
+}
+
+class _ProgressFormatter(logging.Formatter):
+    """Plain message for INFO, 'LEVEL: message' otherwise"""
+    
+    def format(self, record):
+        message = record.getMessage()
+        if record.levelno == logging.INFO:
+            return message
+        return f"{record.levelname}: {message}"
+
+class _ProgressHandler(logging.Handler):
+    """Hand each formatted message to a callback"""
+    
+    def __init__(self, callback, level=logging.NOTSET):
+        super().__init__(level)
+        self.callback = callback
+        self.setFormatter(_ProgressFormatter())
+    
+    def emit(self, record):
+        try:
+            self.callback(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+class _RunHandler(logging.Handler):
+    """Hand each message to the listeners of the run it was logged in"""
+    
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(_ProgressFormatter())
+    
+    def emit(self, record):
+        listeners = _run_listeners.get()
+        if not listeners:
+            return
+        try:
+            message = self.format(record)
+            for callback, level in listeners:
+                if record.levelno >= level:
+                    callback(message)
+        except Exception:
+            self.handleError(record)
+
+logger.addHandler(_ProgressHandler(print)) # Server-side console logging
+logger.addHandler(_RunHandler())
+
+def set_log_level(level):
+    """Set the level of progress messages, e.g. logging.DEBUG or 'INFO'"""
+    logger.setLevel(level)
+
+def add_progress_listener(callback, level=logging.INFO):
+    """
+    Call callback(message) for every progress message at level or above, of
+    every run. Returns a handle for remove_progress_listener.
+    """
+    handler = _ProgressHandler(callback, level)
+    logger.addHandler(handler)
+    return handler
+
+def remove_progress_listener(handle):
+    logger.removeHandler(handle)
+
+def _organizer():
+    """The Organizer of the run in progress, or the default one"""
+    return _current_organizer.get() or _default_organizer
+
+def _log_progress(message, level=logging.INFO):
+    logger.log(level, message)
 
 def normalize_name(name):
     """Normalize names by treating hyphens and spaces as equivalent and removing special chars"""
@@ -34,151 +146,618 @@ def normalize_category(category_name):
         return None
     return category_name.strip().lower()
 
+def category_key(category_name):
+    """Key under which equivalent category names compare equal (JPEG=JPG)"""
+    normalized = normalize_category(category_name)
+    
+    # JPEG and JPG equivalence
+    if normalized in ('jpeg', 'jpg'):
+        return 'jpg'
+    return normalized
+
 def are_categories_equivalent(cat1, cat2):
     """Check if two category names are equivalent (case-insensitive, JPEG=JPG)"""
     if not cat1 or not cat2:
         return False
     
-    norm1 = normalize_category(cat1)
-    norm2 = normalize_category(cat2)
+    return category_key(cat1) == category_key(cat2)
+
+class DirectoryIndex:
+    """
+    In-memory view of the folders and files under the tree being organized.
+
+    A folder is scanned once, the first time it is looked up. After that the
+    planner updates the view in place as it decides to create, move and
+    remove entries, so later steps see the result of earlier ones without
+    touching the disk. Each entry remembers where it lives on disk (its
+    origin), which is what the executor and content comparisons use.
     
-    # Direct match
-    if norm1 == norm2:
-        return True
+    Listing uses os.scandir, so whether an entry is a folder comes with the
+    listing and costs no stat. Sizes and mtimes are only needed for files
+    that are moved and for the manifest; each file is stat'ed at most once,
+    the first time either asks (see stat), and moves keep both.
     
-    # JPEG and JPG equivalence
-    jpeg_variants = {'jpeg', 'jpg'}
-    if norm1 in jpeg_variants and norm2 in jpeg_variants:
-        return True
+    Child folders are also keyed by normalize_name and by category key
+    (JPEG=JPG) so folder lookups are dictionary hits.
     
-    return False
+    settled lists folders known to be organized already, with nothing below
+    them changed since (see load_manifest). walk does not descend into them
+    unless the plan changes something inside them.
+    """
+
+    def __init__(self, settled=()):
+        # folder path -> {name: (is_dir, origin path or None)}, in listing order
+        self._entries = {}
+        # folder path -> {normalize_name(child): child name}, folders only
+        self._by_name = {}
+        # folder path -> {category_key(child): child name}, folders only
+        self._by_category = {}
+        self._settled = set(settled)
+        # folders the plan changed something in, and all folders above them
+        self._touched = set()
+        # origin path -> (size, mtime_ns), filled in by stat
+        self._stats = {}
+
+    @metrics.timed('helper_seconds', helper='scan_directory')
+    def _load(self, path, origin):
+        entries = {}
+        if origin is not None:
+            with os.scandir(origin) as scan:
+                for entry in scan:
+                    entries[entry.name] = (entry.is_dir(), os.path.join(origin, entry.name))
+        self._entries[path] = entries
+        self._reindex(path)
+
+    def _reindex(self, path):
+        by_name = {}
+        by_category = {}
+        for name, (is_dir, _) in self._entries[path].items():
+            if is_dir:
+                by_name.setdefault(normalize_name(name), name)
+                by_category.setdefault(category_key(name), name)
+        self._by_name[path] = by_name
+        self._by_category[path] = by_category
+
+    def _ensure(self, path):
+        """Load folder path if needed and return its normalized key"""
+        if path in self._entries:
+            return path
+        path = os.path.normpath(path)
+        if path in self._entries:
+            return path
+
+        # Descend from the nearest folder already in view, so entries that
+        # were moved or removed by the plan resolve against the plan
+        ancestor = os.path.dirname(path)
+        while ancestor not in self._entries and os.path.dirname(ancestor) != ancestor:
+            ancestor = os.path.dirname(ancestor)
+
+        if ancestor not in self._entries:
+            self._load(path, path)
+            return path
+        
+        for name in os.path.relpath(path, ancestor).split(os.sep):
+            entry = self._entries[ancestor].get(name)
+            current = os.path.join(ancestor, name)
+            if entry is None:
+                raise FileNotFoundError(f"No such folder: '{current}'")
+            if not entry[0]:
+                raise NotADirectoryError(f"Not a folder: '{current}'")
+            if current not in self._entries:
+                self._load(current, entry[1])
+            ancestor = current
+        return path
+    
+    def _lookup(self, path):
+        parent_path, name = os.path.split(path)
+        if name in ('', '.', '..'):
+            path = os.path.normpath(path)
+            parent_path, name = os.path.split(path)
+            if not name:
+                return (os.path.isdir(path), path)
+        if parent_path not in self._entries and path in self._entries:
+            # The folder the view was started from: no need to list its parent
+            return (True, path)
+        try:
+            parent_path = self._ensure(parent_path)
+        except OSError:
+            return None
+        return self._entries[parent_path].get(name)
+    
+    def listdir(self, path):
+        """Return the names in folder path, like os.listdir"""
+        return list(self._entries[self._ensure(path)])
+    
+    def subdirs(self, path):
+        """Return (name, path) pairs for the folders directly inside path"""
+        path = self._ensure(path)
+        return [(name, os.path.join(path, name))
+                for name, (is_dir, _) in self._entries[path].items() if is_dir]
+    
+    def files(self, path):
+        """Return the names of the files directly inside folder path"""
+        path = self._ensure(path)
+        return [name for name, (is_dir, _) in self._entries[path].items() if not is_dir]
+    
+    def exists(self, path):
+        return self._lookup(path) is not None
+    
+    def isdir(self, path):
+        entry = self._lookup(path)
+        return entry is not None and entry[0]
+    
+    def origin(self, path):
+        """Return where the entry at path currently lives on disk"""
+        entry = self._lookup(path)
+        return entry[1] if entry is not None else None
+    
+    def walk(self, top):
+        """
+        Bottom-up walk of the view, listing each folder as os.walk(topdown=False)
+        would. Settled folders below top are listed but not walked.
+        """
+        try:
+            entries = list(self._entries[self._ensure(top)].items())
+        except OSError:
+            return
+        
+        dirs = [name for name, (is_dir, _) in entries if is_dir]
+        files = [name for name, (is_dir, _) in entries if not is_dir]
+        for name in dirs:
+            if not self.settled(os.path.join(top, name)):
+                yield from self.walk(os.path.join(top, name))
+        yield top, dirs, files
+    
+    def settled(self, path):
+        """Whether folder path is settled and the plan has not touched anything in it"""
+        if not self._settled:
+            return False
+        path = os.path.normpath(path)
+        return path in self._settled and path not in self._touched
+    
+    def loaded_folders(self):
+        """Folders of the view that have been listed, i.e. looked at by the plan"""
+        return list(self._entries)
+    
+    def file_count(self):
+        """Number of files in the folders that have been listed"""
+        return sum(not is_dir for entries in self._entries.values() for is_dir, _ in entries.values())
+    
+    def size(self, path):
+        """Bytes in the file at path, or in all files below folder path"""
+        entry = self._lookup(path)
+        if entry is None:
+            return 0
+        if entry[0]:
+            return sum(self.size(os.path.join(path, name)) for name in self.listdir(path))
+        try:
+            return self.stat(path)[0]
+        except OSError:
+            return 0
+    
+    def stat(self, path):
+        """
+        Return (size, mtime_ns) of the file at path, stat'ing its origin the
+        first time it is asked for. Raises OSError like os.stat.
+        """
+        entry = self._lookup(path)
+        if entry is None or entry[1] is None:
+            raise FileNotFoundError(f"No such file: '{path}'")
+        stat = self._stats.get(entry[1])
+        if stat is None:
+            result = os.stat(entry[1])
+            stat = self._stats[entry[1]] = (result.st_size, result.st_mtime_ns)
+        return stat
+    
+    def layout(self, path):
+        """Return the view below folder path as {'files': [...], 'folders': {name: ...}}"""
+        path = self._ensure(path)
+        files = []
+        folders = {}
+        for name, (is_dir, _) in self._entries[path].items():
+            if is_dir:
+                folders[name] = self.layout(os.path.join(path, name))
+            else:
+                files.append(name)
+        return {'files': files, 'folders': folders}
+    
+    def find_by_name(self, path, name):
+        """Return the child folder whose normalize_name matches name, if any"""
+        path = self._ensure(path)
+        child = self._by_name[path].get(normalize_name(name))
+        return os.path.join(path, child) if child is not None else None
+
+    def find_category(self, path, category):
+        """Return the child folder equivalent to category (JPEG=JPG), if any"""
+        path = self._ensure(path)
+        child = self._by_category[path].get(category_key(category))
+        return os.path.join(path, child) if child is not None else None
+    
+    def _touch(self, path):
+        while self._settled and path not in self._touched:
+            self._touched.add(path)
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                break
+            path = parent_path
+    
+    def _insert(self, path, entry):
+        parent_path, name = os.path.split(path)
+        self._touch(parent_path)
+        self._entries[parent_path][name] = entry
+        if entry[0]:
+            self._by_name[parent_path].setdefault(normalize_name(name), name)
+            self._by_category[parent_path].setdefault(category_key(name), name)
+    
+    def _loaded_subtree(self, path):
+        """Yield the keys of folder path and of every folder below it that is in view"""
+        if path not in self._entries:
+            return
+        yield path
+        for name, (is_dir, _) in self._entries[path].items():
+            if is_dir:
+                yield from self._loaded_subtree(os.path.join(path, name))
+    
+    def _remove(self, path):
+        parent_path, name = os.path.split(path)
+        self._touch(parent_path)
+        entry = self._entries[parent_path].pop(name)
+        if entry[0]:
+            self._reindex(parent_path)
+        return entry
+
+    def add(self, path):
+        """
+        Add folder path and any missing ancestors, like os.makedirs.
+        Returns the folders that did not exist yet, outermost first.
+        """
+        path = os.path.normpath(path)
+        missing = []
+        while not self.exists(path):
+            missing.append(path)
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                break
+            path = parent_path
+
+        missing.reverse()
+        for folder in missing:
+            self._ensure(os.path.dirname(folder))
+            self._insert(folder, (True, None))
+            self._entries[folder] = {}
+            self._by_name[folder] = {}
+            self._by_category[folder] = {}
+        return missing
+    
+    def add_file(self, path):
+        """Add a file that the plan creates at path; its folder must be in view"""
+        path = os.path.normpath(path)
+        self._ensure(os.path.dirname(path))
+        self._insert(path, (False, path))
+    
+    def discard(self, path):
+        """Remove the entry at path (and its subtree) from the view"""
+        path = os.path.normpath(path)
+        self._ensure(os.path.dirname(path))
+        subtree = list(self._loaded_subtree(path))
+        self._remove(path)
+        for key in subtree:
+            del self._entries[key]
+            del self._by_name[key]
+            del self._by_category[key]
+
+    def move(self, src, dst):
+        """
+        Move the entry at src to dst with shutil.move semantics (into dst if
+        dst is a folder). Returns the resulting path.
+        """
+        src = os.path.normpath(src)
+        dst = os.path.normpath(dst)
+        if self.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        
+        self._ensure(os.path.dirname(src))
+        self._ensure(os.path.dirname(dst))
+        existing = self._lookup(dst)
+        if existing is not None:
+            if existing[0] or self._lookup(src)[0]:
+                raise FileExistsError(f"Destination path '{dst}' already exists")
+            # os.rename replaces an existing file
+            self._remove(dst)
+        
+        subtree = list(self._loaded_subtree(src))
+        self._insert(dst, self._remove(src))
+        for key in subtree:
+            new_key = dst + key[len(src):]
+            self._entries[new_key] = self._entries.pop(key)
+            self._by_name[new_key] = self._by_name.pop(key)
+            self._by_category[new_key] = self._by_category.pop(key)
+        return dst
+
+def _directory_index():
+    """Return the view of the run in progress, or a throwaway one outside a run"""
+    tree, _ = _active_plan.get()
+    if tree is not None:
+        return tree
+    return DirectoryIndex()
+
+@contextmanager
+def _planning():
+    """
+    Yield the view of the run in progress. When called outside a run (a step
+    used on its own), plan against a fresh view and apply the plan on exit.
+    """
+    tree, plan = _active_plan.get()
+    if plan is not None:
+        yield tree
+        return
+
+    tree, plan = DirectoryIndex(), []
+    token = _active_plan.set((tree, plan))
+    try:
+        yield tree
+    finally:
+        _active_plan.reset(token)
+    execute_plan(plan)
+
+def _plan_makedirs(path):
+    """Plan os.makedirs(path, exist_ok=True): one mkdir per missing folder"""
+    tree, plan = _active_plan.get()
+    for folder in tree.add(path):
+        plan.append(Operation('mkdir', None, folder))
+
+def _plan_move(src, dst, message=None, kind='move'):
+    """Plan shutil.move(src, dst); returns the resulting path"""
+    tree, plan = _active_plan.get()
+    if not tree.exists(src):
+        logger.error("Could not move %s: it is no longer at %s", os.path.basename(src), src)
+        return None
+    size = tree.size(src)
+    try:
+        dst = tree.move(src, dst)
+    except OSError as e:
+        logger.error("Could not move %s: %s", os.path.basename(src), e)
+        return None
+    plan.append(Operation(kind, src, dst, message, size))
+    return dst
+
+def _plan_rmdir(path, message=None):
+    """Plan os.rmdir(path)"""
+    tree, plan = _active_plan.get()
+    tree.discard(path)
+    plan.append(Operation('rmdir', path, None, message))
+
+# Patterns used by the filename parser, compiled once
+_CLEAN_RE = re.compile(r'[^\w\s\.-]', re.UNICODE)
+_SPLIT_RE = re.compile(r'[-_\s]')
+_VARIANT_RE = re.compile(r'^[A-Za-z0-9]$')
+_VERSION_RE = re.compile(r'\d+\.\d+')
+_BRAND_MODEL_RE = re.compile(r'^([a-zA-Z]+)(\d+.*)$')
+_ALPHA_RE = re.compile(r'[a-zA-Z]+')
+_DIGIT_RE = re.compile(r'\d')
 
 def is_variant_code(word):
     """Check if word is a variant code (single letter or number)"""
-    return re.fullmatch(r'^[A-Za-z0-9]$', word)
+    return _VARIANT_RE.fullmatch(word)
 
-def extract_name_code_variant(basename):
+def _is_separator(char):
+    return char in '-_' or char.isspace()
+
+def _lstrip_separators(text):
+    """text without leading hyphens, underscores and whitespace"""
+    start = 0
+    while start < len(text) and _is_separator(text[start]):
+        start += 1
+    return text[start:]
+
+def _rstrip_separators(text):
+    """text without trailing hyphens, underscores and whitespace"""
+    end = len(text)
+    while end > 0 and _is_separator(text[end - 1]):
+        end -= 1
+    return text[:end]
+
+class FilenameParser:
     """
-    Improved extraction that properly handles technical filenames
+    The parser behind extract_name_code_variant. Results are kept in a
+    bounded LRU cache keyed on the basename, so a name seen again in a later
+    step (or a later run) is not parsed twice; cache_info() reports hits
+    and misses.
     """
-    cleaned = re.sub(r'[^\w\s\.-]', '', basename, flags=re.UNICODE)
-    parts = re.split(r'[-_\s]', cleaned)
-    parts = [p for p in parts if p]
     
-    if not parts:
-        return None, None, None
+    def __init__(self, maxsize=65536):
+        self.parse = functools.lru_cache(maxsize=maxsize)(self._parse)
     
-    _log_progress(f"DEBUG: Parsing '{basename}' -> parts: {parts}")
+    def cache_info(self):
+        """Return (hits, misses, maxsize, currsize) of the parse cache"""
+        return self.parse.cache_info()
     
-    name_parts = []
-    code_parts = []
-    variant = None
+    def cache_clear(self):
+        self.parse.cache_clear()
     
-    if len(parts) > 1 and is_variant_code(parts[-1]):
-        variant = parts[-1]
-        parts = parts[:-1]
-        _log_progress(f"DEBUG: Found variant: {variant}")
-    
-    version_pattern = r'\d+\.\d+'
-    tech_with_version_idx = -1
-    
-    for i, part in enumerate(parts):
-        if re.search(version_pattern, part):
-            tech_with_version_idx = i
-            _log_progress(f"DEBUG: Found technical term with version at index {i}: {part}")
-            break
-    
-    if tech_with_version_idx != -1:
-        if tech_with_version_idx == 0:
-            name_parts = parts[:1]
-            code_parts = parts[1:] if len(parts) > 1 else []
-        else:
-            name_parts = parts[:tech_with_version_idx]
-            code_parts = parts[tech_with_version_idx:]
-    else:
-        if len(parts) == 1:
-            single_part = parts[0]
-            brand_model_match = re.match(r'^([a-zA-Z]+)(\d+.*)$', single_part)
-            if brand_model_match:
-                brand = brand_model_match.group(1)
-                model = brand_model_match.group(2)
-                name_parts = [brand]
-                code_parts = [model]
-                _log_progress(f"DEBUG: Split single part brand+model: brand='{brand}', model='{model}'")
+    def _parse(self, basename, debug=True):
+        """
+        Improved extraction that properly handles technical filenames.
+        With debug=False the DEBUG messages are not built at all.
+        """
+        cleaned = _CLEAN_RE.sub('', basename)
+        parts = [p for p in _SPLIT_RE.split(cleaned) if p]
+        
+        if not parts:
+            return None, None, None
+        
+        if debug:
+            logger.debug("Parsing '%s' -> parts: %s", basename, parts)
+        
+        name_parts = []
+        code_parts = []
+        variant = None
+        
+        if len(parts) > 1 and is_variant_code(parts[-1]):
+            variant = parts[-1]
+            parts = parts[:-1]
+            if debug:
+                logger.debug("Found variant: %s", variant)
+        
+        tech_with_version_idx = -1
+        
+        for i, part in enumerate(parts):
+            if _VERSION_RE.search(part):
+                tech_with_version_idx = i
+                if debug:
+                    logger.debug("Found technical term with version at index %s: %s", i, part)
+                break
+        
+        if tech_with_version_idx != -1:
+            if tech_with_version_idx == 0:
+                name_parts = parts[:1]
+                code_parts = parts[1:] if len(parts) > 1 else []
             else:
-                name_parts = [single_part]
-                code_parts = []
+                name_parts = parts[:tech_with_version_idx]
+                code_parts = parts[tech_with_version_idx:]
+        else:
+            if len(parts) == 1:
+                single_part = parts[0]
+                brand_model_match = _BRAND_MODEL_RE.match(single_part)
+                if brand_model_match:
+                    brand = brand_model_match.group(1)
+                    model = brand_model_match.group(2)
+                    name_parts = [brand]
+                    code_parts = [model]
+                    if debug:
+                        logger.debug("Split single part brand+model: brand='%s', model='%s'", brand, model)
+                else:
+                    name_parts = [single_part]
+                    code_parts = []
+                    
+            elif len(parts) == 2:
+                first_part, second_part = parts[0], parts[1]
                 
-        elif len(parts) == 2:
-            first_part, second_part = parts[0], parts[1]
-            
-            brand_model_match = re.match(r'^([a-zA-Z]+)(\d+.*)$', first_part)
-            if brand_model_match:
-                brand = brand_model_match.group(1)
-                model_part1 = brand_model_match.group(2)
-                name_parts = [brand]
-                code_parts = [model_part1, second_part]
-                _log_progress(f"DEBUG: First part has brand+model: brand='{brand}', model='{model_part1}+{second_part}'")
-            else:
-                if re.fullmatch(r'[a-zA-Z]+', first_part) and re.search(r'\d', second_part):
-                    name_parts = [first_part]
-                    code_parts = [second_part]
-                    _log_progress(f"DEBUG: Clear brand-model split: brand='{first_part}', model='{second_part}'")
+                brand_model_match = _BRAND_MODEL_RE.match(first_part)
+                if brand_model_match:
+                    brand = brand_model_match.group(1)
+                    model_part1 = brand_model_match.group(2)
+                    name_parts = [brand]
+                    code_parts = [model_part1, second_part]
+                    if debug:
+                        logger.debug("First part has brand+model: brand='%s', model='%s+%s'", brand, model_part1, second_part)
                 else:
-                    if len(second_part) >= 2:
+                    if _ALPHA_RE.fullmatch(first_part) and _DIGIT_RE.search(second_part):
                         name_parts = [first_part]
                         code_parts = [second_part]
+                        if debug:
+                            logger.debug("Clear brand-model split: brand='%s', model='%s'", first_part, second_part)
                     else:
-                        name_parts = parts
-                        code_parts = []
-        else:
-            first_part = parts[0]
-            
-            if re.fullmatch(r'[a-zA-Z]+', first_part):
-                name_parts = [first_part]
-                code_parts = parts[1:]
-                _log_progress(f"DEBUG: Multi-part with alphabetic brand: brand='{first_part}', code='{parts[1:]}'")
+                        if len(second_part) >= 2:
+                            name_parts = [first_part]
+                            code_parts = [second_part]
+                        else:
+                            name_parts = parts
+                            code_parts = []
             else:
-                product_code_start = 1
-                for i in range(1, len(parts)):
-                    if re.search(r'\d', parts[i]):
-                        product_code_start = i
-                        break
+                first_part = parts[0]
                 
-                name_parts = parts[:product_code_start]
-                code_parts = parts[product_code_start:]
-    
-    name = ' '.join(name_parts).strip() if name_parts else None
-    
-    if code_parts:
-        if len(code_parts) > 1:
-            code_portion = basename
-            if name_parts:
-                for name_part in name_parts:
-                    code_portion = re.sub(rf'^{re.escape(name_part)}[-_\s]*', '', code_portion, 1)
-            
-            if variant:
-                code_portion = re.sub(rf'[-_\s]*{re.escape(variant)}$', '', code_portion)
-            
-            if '_' in code_portion and '-' not in code_portion:
-                code = '_'.join(code_parts)
+                if _ALPHA_RE.fullmatch(first_part):
+                    name_parts = [first_part]
+                    code_parts = parts[1:]
+                    if debug:
+                        logger.debug("Multi-part with alphabetic brand: brand='%s', code='%s'", first_part, parts[1:])
+                else:
+                    product_code_start = 1
+                    for i in range(1, len(parts)):
+                        if _DIGIT_RE.search(parts[i]):
+                            product_code_start = i
+                            break
+                    
+                    name_parts = parts[:product_code_start]
+                    code_parts = parts[product_code_start:]
+        
+        name = ' '.join(name_parts).strip() if name_parts else None
+        
+        if code_parts:
+            if len(code_parts) > 1:
+                # The separator used between the code parts decides how they
+                # are joined back together
+                code_portion = basename
+                if name_parts:
+                    for name_part in name_parts:
+                        if code_portion.startswith(name_part):
+                            code_portion = _lstrip_separators(code_portion[len(name_part):])
+                
+                if variant and code_portion.endswith(variant):
+                    code_portion = _rstrip_separators(code_portion[:-len(variant)])
+                
+                if '_' in code_portion and '-' not in code_portion:
+                    code = '_'.join(code_parts)
+                else:
+                    code = '-'.join(code_parts)
             else:
-                code = '-'.join(code_parts)
+                code = code_parts[0]
         else:
-            code = code_parts[0]
-    else:
-        code = None
-    
-    if not name and code:
-        if not re.search(r'\d', code) and len(code.split('-')) == 1:
-            name = code.replace('-', ' ')
             code = None
+        
+        if not name and code:
+            if not _DIGIT_RE.search(code) and len(code.split('-')) == 1:
+                name = code.replace('-', ' ')
+                code = None
+        
+        if not name and not code:
+            name = ' '.join(parts[:1]) if parts else None
+        
+        if debug:
+            logger.debug("Final result -> name: '%s', code: '%s', variant: '%s'", name, code, variant)
+        return name, code, variant
+
+@metrics.timed('helper_seconds', helper='extract_name_code_variant')
+def extract_name_code_variant(basename):
+    """
+    Improved extraction that properly handles technical filenames.
+    Returns (name, code, variant); results are cached per basename.
+    """
+    return _organizer().parser.parse(basename)
     
-    if not name and not code:
-        name = ' '.join(parts[:1]) if parts else None
+def parser_cache_info():
+    """Return the hit/miss statistics of the filename parser cache"""
+    return _organizer().parser.cache_info()
+
+def parse_filenames(filenames):
+    """
+    Parse and categorize many file names in one call, e.g. a supplier drop
+    before it is written to disk. Takes any iterable of file names and
+    returns columns aligned with it:
+    {'names': [...], 'codes': [...], 'variants': [...], 'categories': [...]}.
+
+    Each distinct name is tokenized and classified once, without per-file
+    logging or cache bookkeeping, and repeats are filled in from that result.
+    A name may include folders; only its last part is parsed, as it is by
+    extract_name_code_variant and get_file_category.
+    """
+    filenames = list(filenames)
+    parser = _organizer().parser
+    results = {}
+    for filename in dict.fromkeys(filenames):
+        basename = os.path.basename(filename)
+        results[filename] = (parser._parse(os.path.splitext(basename)[0], debug=False)
+                             + (get_file_category(basename),))
     
-    _log_progress(f"DEBUG: Final result -> name: '{name}', code: '{code}', variant: '{variant}'")
-    return name, code, variant
+    rows = [results[filename] for filename in filenames]
+    return {
+        'names': [row[0] for row in rows],
+        'codes': [row[1] for row in rows],
+        'variants': [row[2] for row in rows],
+        'categories': [row[3] for row in rows],
+    }
+
+# Category of a file by its (lowercase) extension
+_CATEGORY_BY_EXTENSION = {
+    '.webp': 'WEBP',
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.mp4': 'Videos',
+    '.mov': 'Videos',
+    '.avi': 'Videos',
+    '.mkv': 'Videos',
+}
 
 def get_file_category(filename):
     """Get file category with improved logic"""
@@ -188,31 +767,30 @@ def get_file_category(filename):
     
     if basename.startswith('img'):
         return 'Unedited'
-    if ext in ['.webp']:
-        return 'WEBP'
-    if ext in ['.jpg', '.jpeg']:
-        return 'JPEG'
-    if ext in ['.mp4', '.mov', '.avi', '.mkv']:
-        return 'Videos'
-    return None
+    return _CATEGORY_BY_EXTENSION.get(ext)
+
+def _classify(filename):
+    """
+    Parse and categorize a file name.
+    Returns (name, product_code, variant, category).
+    """
+    basename = os.path.splitext(filename)[0]
+    return extract_name_code_variant(basename) + (get_file_category(filename),)
 
+@metrics.timed('helper_seconds', helper='find_existing_category_folder')
 def find_existing_category_folder(parent_path, target_category):
     """Find existing category folder with case-insensitive and JPEG/JPG equivalence"""
     if not target_category:
         return None
         
-    _log_progress(f"DEBUG: Looking for category folder '{target_category}' in '{parent_path}'")
+    logger.debug("Looking for category folder '%s' in '%s'", target_category, parent_path)
     
-    for item in os.listdir(parent_path):
-        item_path = os.path.join(parent_path, item)
-        if os.path.isdir(item_path):
-            _log_progress(f"DEBUG: Checking folder '{item}' against category '{target_category}'")
-            
-            if are_categories_equivalent(item, target_category):
-                _log_progress(f"DEBUG: Found matching category folder: '{item}' for '{target_category}'")
-                return item_path
+    item_path = _directory_index().find_category(parent_path, target_category)
+    if item_path:
+        logger.debug("Found matching category folder: '%s' for '%s'", os.path.basename(item_path), target_category)
+        return item_path
     
-    _log_progress(f"DEBUG: No matching category folder found for '{target_category}'")
+    logger.debug("No matching category folder found for '%s'", target_category)
     return None
 
 def create_old_images_folder(target_folder, category=None):
@@ -224,26 +802,272 @@ def create_old_images_folder(target_folder, category=None):
     if category:
         old_images_path = os.path.join(old_images_path, category)
     
-    if not os.path.exists(old_images_path):
-        os.makedirs(old_images_path)
-        _log_progress(f"DEBUG: Created Old Images folder: {old_images_path}")
+    with _planning() as tree:
+        if not tree.exists(old_images_path):
+            _plan_makedirs(old_images_path)
+            logger.debug("Created Old Images folder: %s", old_images_path)
     return old_images_path
 
-def get_file_hash(filepath):
-    hash_md5 = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+# Largest single read when hashing; one buffer is reused for the whole file
+HASH_BUFFER_SIZE = 1024 * 1024
+
+@metrics.timed('helper_seconds', helper='get_file_hash')
+def get_file_hash(filepath, algorithm='md5'):
+    """
+    Hex digest of a file's content. algorithm is any hashlib name; MD5 is the
+    default, and 'sha1' or 'blake2b' can be faster depending on the CPU (see
+    benchmarks/bench_hashing.py). The file is read straight into one reusable
+    buffer, so a multi-GB video takes a few thousand reads instead of
+    millions of small copies.
+    """
+    digest = hashlib.new(algorithm)
+    with open(filepath, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        metrics.inc('hashed_bytes_total', size)
+        buffer = bytearray(max(1, min(size, HASH_BUFFER_SIZE)))
+        view = memoryview(buffer)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+class ContentIndex:
+    """
+    Sizes and content hashes of files, cached by (path, size, mtime).
+
+    Two files are compared by size first, then by a hash of their first and
+    last PARTIAL_BYTES, and only then by a hash of their whole content, each
+    computed the first time it is needed. Once a file has been hashed it is
+    not read again until its size or mtime changes. The executor tells the
+    index about moves and removed folders so cached hashes follow the files;
+    files found gone are dropped.
+    """
+    
+    PARTIAL_BYTES = 64 * 1024
+    
+    def __init__(self, algorithm='md5'):
+        self.algorithm = algorithm
+        # path -> [size, mtime_ns, partial hash or None, full hash or None]
+        self._entries = {}
+        # folder -> number of entries below it, so moving a file or a folder
+        # with no entries in it costs a lookup, not a scan of every entry
+        self._folders = {}
+        self._lock = threading.Lock()
+    
+    def _add(self, filepath, entry):
+        if filepath not in self._entries:
+            folder = os.path.dirname(filepath)
+            while True:
+                self._folders[folder] = self._folders.get(folder, 0) + 1
+                parent = os.path.dirname(folder)
+                if parent == folder:
+                    break
+                folder = parent
+        self._entries[filepath] = entry
+    
+    def _pop(self, filepath):
+        entry = self._entries.pop(filepath)
+        folder = os.path.dirname(filepath)
+        while True:
+            count = self._folders[folder] - 1
+            if count:
+                self._folders[folder] = count
+            else:
+                del self._folders[folder]
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
+        return entry
+    
+    def _below(self, folder):
+        """Paths of the entries under folder (caller holds the lock)"""
+        if folder not in self._folders:
+            return []
+        prefix = folder.rstrip(os.sep) + os.sep
+        return [path for path in self._entries if path.startswith(prefix)]
+    
+    def _entry(self, filepath):
+        filepath = os.path.abspath(filepath)
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            with self._lock:
+                if filepath in self._entries:
+                    self._pop(filepath)
+            raise
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                entry = [stat.st_size, stat.st_mtime_ns, None, None]
+                self._add(filepath, entry)
+        return filepath, entry
+    
+    def _partial_hash(self, filepath, entry):
+        if entry[2] is None:
+            if entry[0] <= 2 * self.PARTIAL_BYTES:
+                entry[2] = self._full_hash(filepath, entry)
+            else:
+                digest = hashlib.new(self.algorithm)
+                with open(filepath, "rb") as f:
+                    digest.update(f.read(self.PARTIAL_BYTES))
+                    f.seek(-self.PARTIAL_BYTES, os.SEEK_END)
+                    digest.update(f.read(self.PARTIAL_BYTES))
+                entry[2] = digest.hexdigest()
+        return entry[2]
+    
+    def _full_hash(self, filepath, entry):
+        if entry[3] is None:
+            entry[3] = get_file_hash(filepath, self.algorithm)
+        return entry[3]
+    
+    def size(self, filepath):
+        return self._entry(filepath)[1][0]
+    
+    def partial_hash(self, filepath):
+        """Hash of the first and last PARTIAL_BYTES (the full hash for small files)"""
+        return self._partial_hash(*self._entry(filepath))
+    
+    def full_hash(self, filepath):
+        return self._full_hash(*self._entry(filepath))
+    
+    def same_content(self, file1, file2):
+        """Whether two files have the same bytes, reading as little as possible"""
+        file1, entry1 = self._entry(file1)
+        file2, entry2 = self._entry(file2)
+        if file1 == file2:
+            return True
+        return (entry1[0] == entry2[0]
+                and self._partial_hash(file1, entry1) == self._partial_hash(file2, entry2)
+                and self._full_hash(file1, entry1) == self._full_hash(file2, entry2))
+    
+    def find_duplicates(self, root_path):
+        """
+        Return groups of files under root_path with identical content, in one
+        walk. Only files that share a size are hashed at all.
+        """
+        by_size = {}
+        seen = set()
+        for dirpath, _, filenames in os.walk(root_path):
+            for filename in filenames:
+                try:
+                    filepath, entry = self._entry(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                by_size.setdefault(entry[0], []).append((filepath, entry))
+                seen.add(filepath)
+        self._prune(root_path, seen)
+        
+        groups = [files for files in by_size.values() if len(files) > 1]
+        for key in (self._partial_hash, self._full_hash):
+            refined = []
+            for files in groups:
+                by_hash = {}
+                for filepath, entry in files:
+                    try:
+                        by_hash.setdefault(key(filepath, entry), []).append((filepath, entry))
+                    except OSError:
+                        continue
+                refined.extend(same for same in by_hash.values() if len(same) > 1)
+            groups = refined
+        return [[filepath for filepath, _ in files] for files in groups]
+    
+    def find_content(self, root_path, wanted):
+        """
+        Look for files under root_path with given contents, in one walk.
+        wanted holds (size, full hash) pairs; returns {(size, full hash): path}
+        for the ones found. Only files of a wanted size are hashed at all.
+        """
+        wanted = set(wanted)
+        sizes = {size for size, _ in wanted}
+        found = {}
+        for dirpath, _, filenames in os.walk(root_path):
+            for filename in filenames:
+                try:
+                    filepath, entry = self._entry(os.path.join(dirpath, filename))
+                    if entry[0] not in sizes:
+                        continue
+                    key = (entry[0], self._full_hash(filepath, entry))
+                except OSError:
+                    continue
+                if key in wanted and key not in found:
+                    found[key] = filepath
+                    if len(found) == len(wanted):
+                        return found
+        return found
+    
+    def moved(self, src, dst):
+        """Carry the cached hashes of src (a file or a folder) over to dst"""
+        src = os.path.abspath(src)
+        dst = os.path.abspath(dst)
+        with self._lock:
+            if src in self._entries:
+                self._add(dst, self._pop(src))
+                return
+            for path in self._below(src):
+                self._add(dst + path[len(src):], self._pop(path))
+    
+    def forget(self, path):
+        """Drop what is cached for the file at path, or for everything in folder path"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._entries:
+                self._pop(path)
+            for below in self._below(path):
+                self._pop(below)
+    
+    def _prune(self, root_path, seen):
+        """Drop the entries under root_path that a complete walk of it did not see"""
+        with self._lock:
+            for path in self._below(os.path.abspath(root_path)):
+                if path not in seen:
+                    self._pop(path)
+    
+    def save(self, index_path):
+        """Write the index to index_path as JSON"""
+        with self._lock:
+            entries = dict(self._entries)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'algorithm': self.algorithm, 'files': entries}, f)
+        os.replace(tmp_path, index_path)
+    
+    def load(self, index_path):
+        """
+        Merge a saved index into this one. A missing file, or one saved with
+        another hash algorithm, is ignored.
+        """
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        if saved.get('algorithm') != self.algorithm:
+            return
+        with self._lock:
+            for filepath, entry in saved['files'].items():
+                self._add(filepath, entry)
+
+def find_duplicate_files(folder_path):
+    """Return groups of files under folder_path that have identical content"""
+    return _organizer().content_index.find_duplicates(folder_path)
 
 def are_files_same(file1, file2):
     return normalize_filename(os.path.basename(file1)) == normalize_filename(os.path.basename(file2))
 
+@metrics.timed('helper_seconds', helper='handle_duplicate_files')
 def handle_duplicate_files(file1, file2):
     """
     Properly handle duplicates by moving them to Old Images
     """
-    if are_files_same(file1, file2) and filecmp.cmp(file1, file2, shallow=False):
+    with _planning() as tree:
+        if not are_files_same(file1, file2):
+            return False
+        if not _organizer().content_index.same_content(tree.origin(file1), tree.origin(file2)):
+            return False
+        
         file2_dir = os.path.dirname(file2)
         file2_name = os.path.basename(file2)
         
@@ -256,8 +1080,7 @@ def handle_duplicate_files(file1, file2):
                 break
             
             try:
-                subdirs = [d for d in os.listdir(parent_dir) 
-                          if os.path.isdir(os.path.join(parent_dir, d))]
+                subdirs = tree.subdirs(parent_dir)
                 if len(subdirs) > 1:
                     brand_dir = current_dir
                     break
@@ -278,10 +1101,10 @@ def handle_duplicate_files(file1, file2):
         new_name = f"{basename}_duplicate_{timestamp}{ext}"
         
         old_file_path = os.path.join(old_images_path, new_name)
-        shutil.move(file2, old_file_path)
-        _log_progress(f"Moved duplicate to Old Images: {os.path.relpath(old_file_path, brand_dir)}")
+        _plan_move(file2, old_file_path, kind='archive',
+                   message=f"Moved duplicate to Old Images: {os.path.relpath(old_file_path, brand_dir)}")
+        metrics.inc('duplicates_total')
         return True
-    return False
 
 def should_use_existing_brand_folder(brand_name, existing_folders):
     """
@@ -304,6 +1127,7 @@ def should_use_existing_brand_folder(brand_name, existing_folders):
     
     return None
 
+@metrics.timed('helper_seconds', helper='find_existing_brand_folder')
 def find_existing_brand_folder(root_path, brand_name):
     """
     Find an existing brand folder that matches the given brand name.
@@ -313,348 +1137,304 @@ def find_existing_brand_folder(root_path, brand_name):
         return None
         
     normalized_target = normalize_name(brand_name)
-    target_words = set(brand_name.lower().split())
     
-    _log_progress(f"DEBUG: Looking for brand folder '{brand_name}' (normalized: '{normalized_target}')")
+    logger.debug("Looking for brand folder '%s' (normalized: '%s')", brand_name, normalized_target)
     
-    for item in os.listdir(root_path):
-        item_path = os.path.join(root_path, item)
-        if os.path.isdir(item_path):
-            normalized_item = normalize_name(item)
-            _log_progress(f"DEBUG: Checking folder '{item}' (normalized: '{normalized_item}')")
-            
-            if normalized_item == normalized_target:
-                _log_progress(f"DEBUG: Found exact match: '{item}'")
-                return item_path
-    
-    for item in os.listdir(root_path):
-        item_path = os.path.join(root_path, item)
-        if os.path.isdir(item_path):
-            alt_name1 = brand_name.replace(' ', '-')
-            alt_name2 = brand_name.replace('-', ' ')
-            
-            if (normalize_name(item) == normalize_name(alt_name1) or 
-                normalize_name(item) == normalize_name(alt_name2)):
-                _log_progress(f"DEBUG: Found separator variant match: '{item}'")
-                return item_path
+    # normalize_name drops spaces and hyphens, so separator variants of the
+    # brand name ("Acme Co" / "Acme-Co") share the same key
+    item_path = _directory_index().find_by_name(root_path, brand_name)
+    if item_path:
+        logger.debug("Found exact match: '%s'", os.path.basename(item_path))
+        return item_path
     
-    _log_progress(f"DEBUG: No suitable brand folder found for '{brand_name}'")
+    logger.debug("No suitable brand folder found for '%s'", brand_name)
     return None
 
+@metrics.timed('helper_seconds', helper='find_existing_product_folder')
 def find_existing_product_folder(brand_path, product_code):
     """Find an existing product folder that matches the given product code"""
     if not product_code:
         return None
         
-    normalized_target = normalize_name(product_code)
+    logger.debug("Looking for product folder '%s' in '%s'", product_code, brand_path)
     
-    _log_progress(f"DEBUG: Looking for product folder '{product_code}' in '{brand_path}'")
+    item_path = _directory_index().find_by_name(brand_path, product_code)
+    if item_path:
+        logger.debug("Found matching product folder: '%s'", os.path.basename(item_path))
+        return item_path
     
-    for item in os.listdir(brand_path):
-        item_path = os.path.join(brand_path, item)
-        if os.path.isdir(item_path):
-            normalized_item = normalize_name(item)
-            _log_progress(f"DEBUG: Checking product folder '{item}' (normalized: '{normalized_item}')")
-            
-            if normalized_item == normalized_target:
-                _log_progress(f"DEBUG: Found matching product folder: '{item}'")
-                return item_path
-    
-    _log_progress(f"DEBUG: No matching product folder found for '{product_code}'")
+    logger.debug("No matching product folder found for '%s'", product_code)
     return None
 
 def flatten_nested_folders(root_path):
     """Flatten folders that have nested folders with the same name"""
     _log_progress("\nStep 1: Flattening nested folders...")
-    for dirpath, dirnames, filenames in os.walk(root_path, topdown=False):
-        parent_name = os.path.basename(os.path.dirname(dirpath))
-        current_name = os.path.basename(dirpath)
+    with _planning() as tree:
+        for dirpath, dirnames, filenames in tree.walk(root_path):
+            parent_name = os.path.basename(os.path.dirname(dirpath))
+            current_name = os.path.basename(dirpath)
         
-        if parent_name == current_name:
-            parent_path = os.path.dirname(dirpath)
-            _log_progress(f"Found nested folder: {dirpath}")
+            if parent_name == current_name:
+                parent_path = os.path.dirname(dirpath)
+                _log_progress(f"Found nested folder: {dirpath}")
             
-            for item in os.listdir(dirpath):
-                src = os.path.join(dirpath, item)
-                dst = os.path.join(parent_path, item)
+                for item in tree.listdir(dirpath):
+                    src = os.path.join(dirpath, item)
+                    dst = os.path.join(parent_path, item)
                 
-                if os.path.exists(dst):
-                    if os.path.isdir(dst):
-                        for subitem in os.listdir(src):
-                            sub_src = os.path.join(src, subitem)
-                            sub_dst = os.path.join(dst, subitem)
-                            if os.path.exists(sub_dst):
-                                base, ext = os.path.splitext(subitem)
-                                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                new_name = f"{base}_{timestamp}{ext}"
-                                sub_dst = os.path.join(dst, new_name)
-                            shutil.move(sub_src, sub_dst)
+                    if tree.exists(dst):
+                        if tree.isdir(dst):
+                            for subitem in tree.listdir(src):
+                                sub_src = os.path.join(src, subitem)
+                                sub_dst = os.path.join(dst, subitem)
+                                if tree.exists(sub_dst):
+                                    base, ext = os.path.splitext(subitem)
+                                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                                    new_name = f"{base}_{timestamp}{ext}"
+                                    sub_dst = os.path.join(dst, new_name)
+                                _plan_move(sub_src, sub_dst)
+                        else:
+                            base, ext = os.path.splitext(item)
+                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                            new_name = f"{base}_{timestamp}{ext}"
+                            dst = os.path.join(parent_path, new_name)
+                            _plan_move(src, dst)
                     else:
-                        base, ext = os.path.splitext(item)
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        new_name = f"{base}_{timestamp}{ext}"
-                        dst = os.path.join(parent_path, new_name)
-                        shutil.move(src, dst)
+                        _plan_move(src, dst)
+                
+                if tree.listdir(dirpath):
+                    logger.warning("Could not remove folder %s: folder is not empty", dirpath)
                 else:
-                    shutil.move(src, dst)
-            
-            try:
-                os.rmdir(dirpath)
-                _log_progress(f"Flattened nested folder: {dirpath}")
-            except OSError as e:
-                _log_progress(f"Could not remove folder {dirpath}: {e}")
+                    _plan_rmdir(dirpath, message=f"Flattened nested folder: {dirpath}")
 
 def organize_files_in_brand_folders(folder_path):
     """
     Updated to properly handle existing file conflicts
     """
-    _log_progress(f"DEBUG: Organizing files in brand folders at: {folder_path}")
+    logger.debug("Organizing files in brand folders at: %s", folder_path)
     
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        
-        if (not os.path.isdir(item_path) or 
-            item.lower().startswith('__webp to be move to the right folders')):
-            continue
+    with _planning() as tree:
+        for item, item_path in tree.subdirs(folder_path):
+            if item.lower().startswith('__webp to be move to the right folders'):
+                continue
+            if tree.settled(item_path):
+                continue
             
-        _log_progress(f"DEBUG: Processing folder: {item}")
+            logger.debug("Processing folder: %s", item)
         
-        for file in os.listdir(item_path):
-            file_path = os.path.join(item_path, file)
-            if os.path.isfile(file_path):
-                basename = os.path.splitext(file)[0]
-                _log_progress(f"DEBUG: Processing file: {file}")
+            for file in tree.files(item_path):
+                file_path = os.path.join(item_path, file)
+                logger.debug("Processing file: %s", file)
                 
-                name, product_code, variant = extract_name_code_variant(basename)
+                name, product_code, variant, file_category = _classify(file)
                 
                 if not name:
                     name = item
-                    _log_progress(f"DEBUG: Using folder name as brand: {name}")
-                
-                existing_brand = find_existing_brand_folder(folder_path, name)
-                if existing_brand:
-                    brand_folder = existing_brand
-                    _log_progress(f"DEBUG: Using existing brand folder: {os.path.basename(brand_folder)}")
-                else:
-                    brand_folder = os.path.join(folder_path, name)
-                    _log_progress(f"DEBUG: Creating new brand folder: {name}")
+                    logger.debug("Using folder name as brand: %s", name)
                 
-                os.makedirs(brand_folder, exist_ok=True)
-                
-                if product_code:
-                    _log_progress(f"DEBUG: Looking for product folder: {product_code}")
-                    existing_product = find_existing_product_folder(brand_folder, product_code)
-                    if existing_product:
-                        product_folder = existing_product
-                        _log_progress(f"DEBUG: Using existing product folder: {os.path.basename(product_folder)}")
-                    else:
-                        product_folder = os.path.join(brand_folder, product_code)
-                        _log_progress(f"DEBUG: Creating new product folder: {product_code}")
-                    
-                    os.makedirs(product_folder, exist_ok=True)
-                    target_folder = product_folder
-                else:
-                    target_folder = brand_folder
-                
-                file_category = get_file_category(file)
-                if file_category:
-                    current_folder_name = os.path.basename(target_folder)
-                    if not are_categories_equivalent(current_folder_name, file_category):
-                        existing_category_folder = find_existing_category_folder(target_folder, file_category)
-                        if existing_category_folder:
-                            final_folder = existing_category_folder
-                            _log_progress(f"DEBUG: Using existing category folder: {os.path.basename(final_folder)}")
-                        else:
-                            final_folder = os.path.join(target_folder, file_category)
-                            _log_progress(f"DEBUG: Creating new category folder: {file_category}")
-                        
-                        os.makedirs(final_folder, exist_ok=True)
-                        dst = os.path.join(final_folder, file)
-                    else:
-                        dst = os.path.join(target_folder, file)
-                        _log_progress(f"DEBUG: File already in correct category folder")
-                else:
-                    dst = os.path.join(target_folder, file)
-                
-                if os.path.exists(dst):
-                    _log_progress(f"DEBUG: File already exists at destination: {dst}")
-                    file_category = get_file_category(file)
-                    old_images_folder = create_old_images_folder(target_folder, file_category)
-                    handle_existing_file(dst, old_images_folder)
-                
-                try:
-                    shutil.move(file_path, dst)
-                    _log_progress(f"DEBUG: Moved {file} to: {os.path.relpath(dst, folder_path)}")
-                except Exception as e:
-                    _log_progress(f"ERROR: Failed to move {file}: {e}")
+                dst = _plan_destination(folder_path, file, name, product_code, file_category)
+                _plan_move(file_path, dst,
+                           message=f"Moved {file} to: {os.path.relpath(dst, folder_path)}")
+
+def _plan_destination(folder_path, file, name, product_code, file_category):
+    """
+    Plan the brand/product/category folders under folder_path for a file
+    that parsed as name, product_code and file_category, and archive a file
+    already at its place. Returns the path the file goes to.
+    """
+    tree = _directory_index()
+    existing_brand = find_existing_brand_folder(folder_path, name)
+    if existing_brand:
+        brand_folder = existing_brand
+        logger.debug("Using existing brand folder: %s", os.path.basename(brand_folder))
+    else:
+        brand_folder = os.path.join(folder_path, name)
+        logger.debug("Creating new brand folder: %s", name)
+    
+    _plan_makedirs(brand_folder)
+    
+    if product_code:
+        logger.debug("Looking for product folder: %s", product_code)
+        existing_product = find_existing_product_folder(brand_folder, product_code)
+        if existing_product:
+            product_folder = existing_product
+            logger.debug("Using existing product folder: %s", os.path.basename(product_folder))
+        else:
+            product_folder = os.path.join(brand_folder, product_code)
+            logger.debug("Creating new product folder: %s", product_code)
+        
+        _plan_makedirs(product_folder)
+        target_folder = product_folder
+    else:
+        target_folder = brand_folder
+    
+    if file_category:
+        current_folder_name = os.path.basename(target_folder)
+        if not are_categories_equivalent(current_folder_name, file_category):
+            existing_category_folder = find_existing_category_folder(target_folder, file_category)
+            if existing_category_folder:
+                final_folder = existing_category_folder
+                logger.debug("Using existing category folder: %s", os.path.basename(final_folder))
+            else:
+                final_folder = os.path.join(target_folder, file_category)
+                logger.debug("Creating new category folder: %s", file_category)
+            
+            _plan_makedirs(final_folder)
+            dst = os.path.join(final_folder, file)
+        else:
+            dst = os.path.join(target_folder, file)
+            logger.debug("File already in correct category folder")
+    else:
+        dst = os.path.join(target_folder, file)
+    
+    if tree.exists(dst):
+        logger.debug("File already exists at destination: %s", dst)
+        old_images_folder = create_old_images_folder(target_folder, file_category)
+        handle_existing_file(dst, old_images_folder)
+    return dst
 
 def organize_folder_contents(folder_path, is_webp_folder=False):
     """Organize folder contents with proper Old Images handling"""
-    for root, dirs, files in os.walk(folder_path, topdown=False):
-        if root == folder_path and not is_webp_folder:
-            continue
-            
-        for filename in files:
-            if '.' not in filename:
+    with _planning() as tree:
+        for root, dirs, files in tree.walk(folder_path):
+            if root == folder_path and not is_webp_folder:
                 continue
 
-            file_path = os.path.join(root, filename)
-            basename = os.path.splitext(filename)[0]
+            for filename in files:
+                if '.' not in filename:
+                    continue
             
-            name, product_code, variant = extract_name_code_variant(basename)
+                file_path = os.path.join(root, filename)
 
-            if not name:
-                _log_progress(f"Skipped '{filename}': couldn't determine name.")
-                continue
+                name, product_code, variant, file_category = _classify(filename)
 
-            if is_webp_folder:
-                main_folder = os.path.dirname(folder_path)
-                existing_brand = find_existing_brand_folder(main_folder, name)
-                if existing_brand:
-                    name_folder_path = existing_brand
-                    _log_progress(f"Using existing brand folder for WEBP: {os.path.basename(name_folder_path)}")
-                else:
-                    name_folder_path = os.path.join(folder_path, name)
-                    _log_progress(f"Creating new brand folder for WEBP: {os.path.basename(name_folder_path)}")
+                if not name:
+                    _log_progress(f"Skipped '{filename}': couldn't determine name.")
+                    continue
                 
-                os.makedirs(name_folder_path, exist_ok=True)
+                if is_webp_folder:
+                    main_folder = os.path.dirname(folder_path)
+                    existing_brand = find_existing_brand_folder(main_folder, name)
+                    if existing_brand:
+                        name_folder_path = existing_brand
+                        logger.debug("Using existing brand folder for WEBP: %s", os.path.basename(name_folder_path))
+                    else:
+                        name_folder_path = os.path.join(folder_path, name)
+                        logger.debug("Creating new brand folder for WEBP: %s", os.path.basename(name_folder_path))
                 
-                if product_code:
-                    existing_product = find_existing_product_folder(name_folder_path, product_code)
-                    if existing_product:
-                        product_folder_path = existing_product
-                        _log_progress(f"Using existing product folder for WEBP: {os.path.basename(product_folder_path)}")
+                    _plan_makedirs(name_folder_path)
+                    
+                    if product_code:
+                        existing_product = find_existing_product_folder(name_folder_path, product_code)
+                        if existing_product:
+                            product_folder_path = existing_product
+                            logger.debug("Using existing product folder for WEBP: %s", os.path.basename(product_folder_path))
+                        else:
+                            product_folder_path = os.path.join(name_folder_path, product_code)
+                            logger.debug("Creating new product folder for WEBP: %s", os.path.basename(product_folder_path))
+                        
+                        _plan_makedirs(product_folder_path)
+                        target_folder = product_folder_path
                     else:
-                        product_folder_path = os.path.join(name_folder_path, product_code)
-                        _log_progress(f"Creating new product folder for WEBP: {os.path.basename(product_folder_path)}")
+                        target_folder = name_folder_path
                     
-                    os.makedirs(product_folder_path, exist_ok=True)
-                    target_folder = product_folder_path
-                else:
-                    target_folder = name_folder_path
+                    if file_category:
+                        current_folder_name = os.path.basename(target_folder)
+                        if not are_categories_equivalent(current_folder_name, file_category):
+                            existing_category_folder = find_existing_category_folder(target_folder, file_category)
+                            if existing_category_folder:
+                                final_folder_path = existing_category_folder
+                            else:
+                                final_folder_path = os.path.join(target_folder, file_category)
                 
-                file_category = get_file_category(filename)
-                if file_category:
-                    current_folder_name = os.path.basename(target_folder)
-                    if not are_categories_equivalent(current_folder_name, file_category):
-                        existing_category_folder = find_existing_category_folder(target_folder, file_category)
-                        if existing_category_folder:
-                            final_folder_path = existing_category_folder
+                            _plan_makedirs(final_folder_path)
+                            dst = os.path.join(final_folder_path, filename)
                         else:
-                            final_folder_path = os.path.join(target_folder, file_category)
-                        
-                        os.makedirs(final_folder_path, exist_ok=True)
-                        dst = os.path.join(final_folder_path, filename)
+                            dst = os.path.join(target_folder, filename)
                     else:
                         dst = os.path.join(target_folder, filename)
-                else:
-                    dst = os.path.join(target_folder, filename)
                 
-                try:
                     if file_path != dst:
-                        if os.path.exists(dst):
-                            file_category = get_file_category(filename)
+                        if tree.exists(dst):
                             old_images_folder = create_old_images_folder(target_folder, file_category)
                             handle_existing_file(dst, old_images_folder)
-                        shutil.move(file_path, dst)
-                        _log_progress(f"Organized in WEBP folder: {os.path.relpath(dst, folder_path)}")
-                except Exception as e:
-                    _log_progress(f"Error moving {filename}: {str(e)}")
-            else:
-                file_category = get_file_category(filename)
-                if file_category:
-                    current_dir = os.path.basename(os.path.normpath(root))
-                    if not are_categories_equivalent(current_dir, file_category):
-                        existing_category_folder = find_existing_category_folder(root, file_category)
-                        if existing_category_folder:
-                            final_folder_path = existing_category_folder
+                        _plan_move(file_path, dst,
+                                   message=f"Organized in WEBP folder: {os.path.relpath(dst, folder_path)}")
+                else:
+                    if file_category:
+                        current_dir = os.path.basename(os.path.normpath(root))
+                        if not are_categories_equivalent(current_dir, file_category):
+                            existing_category_folder = find_existing_category_folder(root, file_category)
+                            if existing_category_folder:
+                                final_folder_path = existing_category_folder
+                            else:
+                                final_folder_path = os.path.join(root, file_category)
+                            
+                            _plan_makedirs(final_folder_path)
+                            dst = os.path.join(final_folder_path, filename)
                         else:
-                            final_folder_path = os.path.join(root, file_category)
+                            dst = os.path.join(root, filename)
                         
-                        os.makedirs(final_folder_path, exist_ok=True)
-                        dst = os.path.join(final_folder_path, filename)
-                    else:
-                        dst = os.path.join(root, filename)
-                    
-                    try:
                         if file_path != dst:
-                            if os.path.exists(dst):
-                                file_category = get_file_category(filename)
+                            if tree.exists(dst):
                                 old_images_folder = create_old_images_folder(root, file_category)
                                 handle_existing_file(dst, old_images_folder)
-                            shutil.move(file_path, dst)
-                            _log_progress(f"Organized in main folder: {os.path.relpath(dst, folder_path)}")
-                    except Exception as e:
-                        _log_progress(f"Error moving {filename}: {str(e)}")
+                            _plan_move(file_path, dst,
+                                       message=f"Organized in main folder: {os.path.relpath(dst, folder_path)}")
 
 def find_matching_folder(target_root, folder_name):
     """Find matching folder with improved multi-word name handling"""
-    normalized_target = normalize_name(folder_name)
-    
-    for item in os.listdir(target_root):
-        if os.path.isdir(os.path.join(target_root, item)):
-            normalized_item = normalize_name(item)
-            
-            if normalized_item == normalized_target:
-                return os.path.join(target_root, item)
-            
-            if normalized_item == normalize_name(folder_name.replace(' ', '-')):
-                return os.path.join(target_root, item)
-            if normalized_item == normalize_name(folder_name.replace('-', ' ')):
-                return os.path.join(target_root, item)
-    
-    return None
+    # Separator variants ("Acme Co" / "Acme-Co") normalize to the same key
+    return _directory_index().find_by_name(target_root, folder_name)
 
 def merge_folders(source_path, target_path):
     """
     Updated merge function to properly handle file conflicts
     """
-    for item in os.listdir(source_path):
-        src_item_path = os.path.join(source_path, item)
+    with _planning() as tree:
+        for item in tree.listdir(source_path):
+            src_item_path = os.path.join(source_path, item)
         
-        if os.path.isdir(src_item_path):
-            target_item_path = find_matching_folder(target_path, item)
+            if tree.isdir(src_item_path):
+                target_item_path = find_matching_folder(target_path, item)
             
-            if not target_item_path:
-                target_item_path = os.path.join(target_path, item)
+                if not target_item_path:
+                    target_item_path = os.path.join(target_path, item)
             
-            if os.path.exists(target_item_path):
-                merge_folders(src_item_path, target_item_path)
+                if tree.exists(target_item_path):
+                    merge_folders(src_item_path, target_item_path)
+                else:
+                    _plan_move(src_item_path, target_item_path,
+                               message=f"Moved new folder {item} to {target_path}")
             else:
-                shutil.move(src_item_path, target_item_path)
-                _log_progress(f"Moved new folder {item} to {target_path}")
-        else:
-            file_category = get_file_category(item)
-            if file_category:
-                current_dir = os.path.basename(os.path.normpath(target_path))
-                if not are_categories_equivalent(current_dir, file_category):
-                    existing_category_folder = find_existing_category_folder(target_path, file_category)
-                    if existing_category_folder:
-                        final_folder = existing_category_folder
+                file_category = get_file_category(item)
+                if file_category:
+                    current_dir = os.path.basename(os.path.normpath(target_path))
+                    if not are_categories_equivalent(current_dir, file_category):
+                        existing_category_folder = find_existing_category_folder(target_path, file_category)
+                        if existing_category_folder:
+                            final_folder = existing_category_folder
+                        else:
+                            final_folder = os.path.join(target_path, file_category)
+                            _plan_makedirs(final_folder)
+                        
+                        dst = os.path.join(final_folder, item)
                     else:
-                        final_folder = os.path.join(target_path, file_category)
-                        os.makedirs(final_folder, exist_ok=True)
-                    
-                    dst = os.path.join(final_folder, item)
+                        dst = os.path.join(target_path, item)
                 else:
                     dst = os.path.join(target_path, item)
-            else:
-                dst = os.path.join(target_path, item)
             
-            if os.path.exists(dst):
-                if handle_duplicate_files(src_item_path, dst):
-                    continue
-                else:
-                    base, ext = os.path.splitext(item)
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    new_name = f"{base}_conflict_{timestamp}{ext}"
-                    dst = os.path.join(os.path.dirname(dst), new_name)
+                if tree.exists(dst):
+                    if handle_duplicate_files(src_item_path, dst):
+                        continue
+                    else:
+                        base, ext = os.path.splitext(item)
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        new_name = f"{base}_conflict_{timestamp}{ext}"
+                        dst = os.path.join(os.path.dirname(dst), new_name)
             
-            try:
-                shutil.move(src_item_path, dst)
-                _log_progress(f"Moved file {item} to {os.path.relpath(dst, target_path)}")
-            except Exception as e:
-                _log_progress(f"Error moving {item}: {e}")
+                _plan_move(src_item_path, dst,
+                           message=f"Moved file {item} to {os.path.relpath(dst, target_path)}")
 
 def handle_existing_file(existing_file_path, old_images_folder):
     """Handle existing files by moving them to Old Images with timestamp"""
@@ -665,106 +1445,1285 @@ def handle_existing_file(existing_file_path, old_images_folder):
     
     old_file_path = os.path.join(old_images_folder, new_name)
     
-    try:
-        shutil.move(existing_file_path, old_file_path)
-        _log_progress(f"Moved existing file to Old Images: {os.path.relpath(old_file_path)}")
-    except Exception as e:
-        _log_progress(f"Error moving existing file to Old Images: {e}")
+    with _planning() as tree:
+        # The same name can be replaced more than once within a second,
+        # e.g. by several members of one archive
+        counter = 1
+        while tree.exists(old_file_path):
+            old_file_path = os.path.join(old_images_folder, f"{base}_replaced_{timestamp}_{counter}{ext}")
+            counter += 1
+        _plan_move(existing_file_path, old_file_path, kind='archive',
+                   message=f"Moved existing file to Old Images: {os.path.relpath(old_file_path)}")
 
 def remove_empty_folders(folder_path):
     """Remove empty folders recursively, but preserve WEBP folder"""
     _log_progress(f"\nStep 6: Removing empty folders...")
-    for root, dirs, files in os.walk(folder_path, topdown=False):
-        for dir_name in dirs:
-            dir_path = os.path.join(root, dir_name)
+    with _planning() as tree:
+        for root, dirs, files in tree.walk(folder_path):
+            for dir_name in dirs:
+                dir_path = os.path.join(root, dir_name)
             
-            if dir_name.lower().startswith('__webp to be move to the right folders'):
-                _log_progress(f"Preserving WEBP folder: {os.path.relpath(dir_path, folder_path)}")
-                continue
+                if dir_name.lower().startswith('__webp to be move to the right folders'):
+                    _log_progress(f"Preserving WEBP folder: {os.path.relpath(dir_path, folder_path)}")
+                    continue
                 
-            try:
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    _log_progress(f"Removed empty folder: {os.path.relpath(dir_path, folder_path)}")
-            except OSError:
-                pass
+                try:
+                    if not tree.listdir(dir_path):
+                        _plan_rmdir(dir_path,
+                                    message=f"Removed empty folder: {os.path.relpath(dir_path, folder_path)}")
+                except OSError:
+                    pass
+
+def find_webp_folder(main_folder):
+    """Return the '__WEBP to be move to the right folders' folder, if any"""
+    for item, item_path in _directory_index().subdirs(main_folder):
+        if item.lower().startswith('__webp to be move to the right folders'):
+            return item_path
+    return None
 
 def move_webp_folders_to_main(main_folder):
     """Move folders from WEBP folder to main folder structure"""
-    webp_folder_path = None
-    
-    for item in os.listdir(main_folder):
-        item_path = os.path.join(main_folder, item)
-        if (os.path.isdir(item_path) and 
-            item.lower().startswith('__webp to be move to the right folders')):
-            webp_folder_path = item_path
-            break
+    with _planning() as tree:
+        webp_folder_path = find_webp_folder(main_folder)
     
-    if not webp_folder_path:
-        _log_progress("No WEBP folder found to move")
-        return
+        if not webp_folder_path:
+            _log_progress("No WEBP folder found to move")
+            return
     
-    _log_progress(f"Found WEBP folder: {webp_folder_path}")
+        _log_progress(f"Found WEBP folder: {webp_folder_path}")
     
-    for item in os.listdir(webp_folder_path):
-        source_folder = os.path.join(webp_folder_path, item)
-        
-        if os.path.isdir(source_folder):
+        for item, source_folder in tree.subdirs(webp_folder_path):
             existing_folder = find_matching_folder(main_folder, item)
-            
+        
             if existing_folder:
                 _log_progress(f"Merging {item} with existing folder {os.path.basename(existing_folder)}")
                 merge_folders(source_folder, existing_folder)
             else:
                 target_folder = os.path.join(main_folder, item)
-                shutil.move(source_folder, target_folder)
-                _log_progress(f"Moved {item} to main folder")
+                _plan_move(source_folder, target_folder, message=f"Moved {item} to main folder")
+        
+        if not tree.listdir(webp_folder_path):
+            _plan_rmdir(webp_folder_path, message=f"Removed empty WEBP folder")
+        else:
+            _log_progress(f"WEBP folder not empty, keeping it")
     
+# Moves to another file system copy the data: in the kernel where
+# os.copy_file_range can, otherwise through a buffer this large
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+def _copy_data(fsrc, fdst, size):
+    """Copy size bytes from open file fsrc to fdst; returns the bytes copied"""
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(size - copied, 1 << 30))
+                if not count:
+                    break
+                copied += count
+        except OSError as e:
+            # Some kernels and file systems cannot copy between these two
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP, errno.EPERM):
+                raise
+        if copied:
+            return copied
+    shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+    return fdst.tell()
+
+def _copy_file(src, dst):
+    """
+    Copy file src to dst with its permissions and times. The copy is made
+    under a temporary name, which becomes dst once it has every byte and is
+    synced to disk. Returns its size.
+    """
+    part_path = dst + '.part'
     try:
-        if not os.listdir(webp_folder_path):
-            os.rmdir(webp_folder_path)
-            _log_progress(f"Removed empty WEBP folder")
+        with open(src, 'rb') as fsrc, open(part_path, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = _copy_data(fsrc, fdst, size)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+            written = os.fstat(fdst.fileno()).st_size
+        if copied != size or written != size:
+            raise OSError(errno.EIO, f"Copied {written} of {size} bytes", src)
+        shutil.copystat(src, part_path)
+        os.replace(part_path, dst)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    return size
+
+def _copy_tree(src, dst):
+    """Copy folder src to a new folder dst, file by file; returns the bytes copied"""
+    os.mkdir(dst)
+    copied = 0
+    with os.scandir(src) as scan:
+        for entry in scan:
+            target = os.path.join(dst, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), target)
+            elif entry.is_dir():
+                copied += _copy_tree(entry.path, target)
+            else:
+                copied += _copy_file(entry.path, target)
+    shutil.copystat(src, dst)
+    return copied
+
+def _move(src, dst):
+    """
+    Move src to dst, the path it is to end up at: plans have resolved moves
+    into a folder already, so unlike shutil.move this does not look at dst
+    first. Within a file system it is one rename.
+
+    Across file systems the data is copied and checked (see _copy_file),
+    and src is removed once the copy is complete at dst. A folder is copied
+    whole under a temporary name first. An interruption can leave src
+    behind next to a complete copy, but never a partial one at dst.
+    """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    _log_progress(f"Copying {os.path.basename(src)} to another file system...")
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        os.unlink(src)
+        copied = 0
+    elif os.path.isdir(src):
+        part_path = dst + '.part'
+        # Left by an earlier attempt that was interrupted
+        shutil.rmtree(part_path, ignore_errors=True)
+        try:
+            copied = _copy_tree(src, part_path)
+            os.rename(part_path, dst)
+        except BaseException:
+            shutil.rmtree(part_path, ignore_errors=True)
+            raise
+        shutil.rmtree(src)
+    else:
+        copied = _copy_file(src, dst)
+        os.unlink(src)
+    metrics.inc('cross_device_moves_total')
+    metrics.inc('copied_bytes_total', copied)
+
+def _apply_operation(op):
+    """Apply one planned operation, logging its message once it is done"""
+    start = time.perf_counter()
+    try:
+        if op.kind == 'mkdir':
+            try:
+                os.mkdir(op.dst)
+            except FileExistsError:
+                pass
+        elif op.kind == 'rmdir':
+            os.rmdir(op.src)
+            _organizer().content_index.forget(op.src)
+        else:
+            _move(op.src, op.dst)
+            _organizer().content_index.moved(op.src, op.dst)
+    except Exception as e:
+        logger.error("Could not apply %s for %s: %s", op.kind, op.src or op.dst, e)
+        metrics.inc('failed_operations_total', kind=op.kind)
+        return False
+    
+    metrics.observe('operation_seconds', time.perf_counter() - start, kind=op.kind)
+    if op.size:
+        metrics.inc('moved_bytes_total', op.size)
+    if op.message:
+        _log_progress(op.message)
+    return True
+
+def _applied(op):
+    """
+    Whether op looks applied already, judging by the disk: its folder is
+    there (mkdir), what it would remove is gone (rmdir), or what it would
+    move is gone or already at its destination. Plans only move to free
+    paths, but a path freed by one operation may be filled by a later one,
+    so a source that is there again does not mean the move is still to do.
+    A folder whose parent is gone counts as made: a later operation moved
+    the parent away.
+    """
+    if op.kind == 'mkdir':
+        return os.path.isdir(op.dst) or not os.path.isdir(os.path.dirname(op.dst))
+    if op.kind == 'rmdir':
+        return not os.path.lexists(op.src)
+    return not os.path.lexists(op.src) or os.path.lexists(op.dst)
+
+def _apply_counted(op, replay=False):
+    """
+    _apply_operation, counted in the progress of the run and recorded in its
+    journal if it has them. With replay, an operation that looks applied
+    already (see _applied) is counted as done without touching the disk.
+    """
+    applied = True if replay and _applied(op) else _apply_operation(op)
+    journal = _run_journal.get()
+    if applied and journal is not None:
+        journal.completed(op)
+    progress = _plan_progress.get()
+    if progress is not None:
+        progress.advance(op, applied)
+    return applied
+
+def _apply_after(op, prerequisites, replay):
+    futures.wait(prerequisites)
+    return _apply_counted(op, replay)
+
+def _execute_concurrently(operations, workers, replay):
+    """
+    Apply a plan with a pool of worker threads. An operation waits for every
+    earlier operation on the same path, on a folder above it, or on anything
+    inside it (for a folder), so operations that could interfere keep the
+    plan's order while the rest overlap.
+    """
+    # path -> operations on exactly that path / on that path or anything below
+    at_path = {}
+    under_path = {}
+    submitted = []
+    
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for op in operations:
+            paths = [os.path.normcase(os.path.normpath(p)) for p in (op.src, op.dst) if p]
+            prerequisites = set()
+            for path in paths:
+                pending = [f for f in under_path.get(path, ()) if not f.done()]
+                under_path[path] = pending
+                prerequisites.update(pending)
+                parent = os.path.dirname(path)
+                while parent != path:
+                    prerequisites.update(f for f in at_path.get(parent, ()) if not f.done())
+                    path, parent = parent, os.path.dirname(parent)
+            
+            # Each worker logs in a copy of this context, so its messages
+            # still reach the listeners of the run
+            future = pool.submit(contextvars.copy_context().run, _apply_after, op, prerequisites, replay)
+            submitted.append(future)
+            for path in paths:
+                at_path.setdefault(path, []).append(future)
+                parent = None
+                while parent != path:
+                    under_path.setdefault(path, []).append(future)
+                    parent, path = path, os.path.dirname(path)
+    
+    # result() re-raises anything a worker did not handle
+    return [op for op, future in zip(operations, submitted) if not future.result()]
+
+def execute_plan(operations, workers=None, replay=False):
+    """
+    Apply a plan to disk, in order. Each folder in the plan is created with a
+    single mkdir since the plan already lists every missing parent before its
+    children. Failed operations are logged and skipped.
+    
+    With workers > 1 the operations run on that many threads, which mostly
+    pays off on network storage where every move is a round trip. Operations
+    on unrelated paths may then finish in any order.
+    
+    replay=True is for plans that may have been applied in part already, such
+    as the rest of an interrupted run: operations that look applied are
+    skipped (see _applied).
+    
+    Returns the operations that failed.
+    """
+    if workers and workers > 1:
+        return _execute_concurrently(operations, workers, replay)
+    
+    return [op for op in operations if not _apply_counted(op, replay)]
+
+def summarize_plan(operations):
+    """Count the operations of a plan by kind, e.g. {'mkdir': 12, 'move': 340}"""
+    counts = {}
+    for op in operations:
+        counts[op.kind] = counts.get(op.kind, 0) + 1
+    return counts
+
+def _mount_points():
+    """Mount points in /proc/self/mounts, longest first, or None without one"""
+    try:
+        with open('/proc/self/mounts', encoding='utf-8') as f:
+            lines = f.read().splitlines()
     except OSError:
-        _log_progress(f"WEBP folder not empty, keeping it")
+        return None
+    
+    mounts = set()
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 1:
+            # Spaces and other blanks are written as octal escapes (\040)
+            mounts.add(re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1]))
+    return sorted(mounts, key=len, reverse=True)
+
+class _FileSystems:
+    """
+    The file system a path is on, as a mount point where the mount table
+    can be read, so no path has to be stat'ed, or else as the st_dev of its
+    folder, asked for once per folder. A path that does not exist yet, like
+    a folder the plan makes, is on the file system of the nearest folder
+    above it that does. Links are not followed.
+    """
+    
+    def __init__(self):
+        self._mounts = _mount_points()
+        self._folders = {} # folder -> file system
+    
+    def of(self, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        file_system = self._folders.get(folder)
+        if file_system is None:
+            file_system = self._folders[folder] = self._find(folder)
+        return file_system
+    
+    def _find(self, folder):
+        if self._mounts is not None:
+            for mount in self._mounts:
+                if folder == mount or folder.startswith(mount.rstrip(os.sep) + os.sep):
+                    return mount
+        while True:
+            try:
+                return os.stat(folder).st_dev
+            except OSError:
+                parent = os.path.dirname(folder)
+                if parent == folder:
+                    return folder
+                folder = parent
+
+def cross_device_moves(operations):
+    """
+    The moves and archives of a plan that go to another file system, where
+    they copy the data instead of renaming (see _move)
+    """
+    file_systems = _FileSystems()
+    return [op for op in operations if op.kind in ('move', 'archive')
+            and file_systems.of(op.src) != file_systems.of(op.dst)]
+
+def undo_plan(operations):
+    """
+    Return the plan that backs out operations once they have been applied:
+    every move is reversed and every created folder removed, newest first.
+    """
+    undo = []
+    for op in reversed(operations):
+        if op.kind == 'mkdir':
+            undo.append(Operation('rmdir', op.dst, None))
+        elif op.kind == 'rmdir':
+            undo.append(Operation('mkdir', None, op.src))
+        else:
+            undo.append(Operation('move', op.dst, op.src, size=op.size))
+    return undo
 
-def organize_files_web(folder_path):
-    """Main function to orchestrate the file organization process for web"""
-    global _progress_messages
-    _progress_messages = [] # Clear messages for a new run
+# Least time between two progress reports while a plan is applied
+PROGRESS_INTERVAL = 0.25
 
-    if not os.path.exists(folder_path):
-        _log_progress(f"Error: Folder '{folder_path}' does not exist.")
-        return False, _progress_messages
+class PlanProgress:
+    """
+    Counts the work of a run and reports it to callback(report) as a dict:
+    
+      phase        'planning', 'applying' or 'done'
+      step         number of the step being applied (see STEP_TITLES)
+      step_title   its title
+      step_done    operations of that step applied so far
+      step_total   operations of that step in the plan
+      step_eta     estimated seconds left in that step, at its own rate, or
+                   None before its first operation
+      done, total  operations applied so far / in the plan
+      failed       operations that could not be applied
+      bytes_done   bytes moved so far
+      bytes_total  bytes the plan moves
+      files        files in the folders the plan looked at
+      elapsed      seconds since the plan started being applied
+      rate         operations applied per second
+      bytes_rate   bytes moved per second
+      eta          estimated seconds left, or None before the first operation
+    
+    The totals are known before anything is applied, since planning happens
+    in memory first, so done/total is exact. Reports come at most
+    PROGRESS_INTERVAL apart, except when a step starts and at the end.
+    """
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._phase = 'planning'
+        self._steps = [] # [step, first operation, operations, applied, started], in order
+        self._step_of = {} # id(operation) -> its entry in _steps
+        self._current = None
+        self.total = self.done = self.failed = 0
+        self.bytes_total = self.bytes_done = 0
+        self.files = 0
+        self._started = None
+        self._last_done = None # when the last operation was counted
+        self._reported = 0
     
-    _log_progress(f"Starting organization of: {folder_path}")
+    def planned(self, operations, steps, files):
+        """
+        Record the plan about to be applied. steps holds (step, index of its
+        first operation) pairs, in order, as _plan_run returns them.
+        """
+        with self._lock:
+            bounds = list(steps) + [(None, len(operations))]
+            self._steps = [[step, start, end - start, 0, None]
+                           for (step, start), (_, end) in zip(bounds, bounds[1:])]
+            for entry in self._steps:
+                _, start, count, _, _ = entry
+                for op in operations[start:start + count]:
+                    self._step_of[id(op)] = entry
+            self.total = len(operations)
+            self.bytes_total = sum(op.size or 0 for op in operations)
+            self.files = files
+            self._phase = 'applying'
+            self._started = self._last_done = time.monotonic()
+            self._report()
+    
+    def advance(self, op, applied=True):
+        """Count op as done; operations that failed count as done as well"""
+        with self._lock:
+            self.done += 1
+            if applied:
+                self.bytes_done += op.size or 0
+            else:
+                self.failed += 1
+            now = time.monotonic()
+            entry = self._step_of.get(id(op))
+            if entry is not None:
+                if entry[4] is None:
+                    # The step's first operation started about when the
+                    # one before it was done
+                    entry[4] = self._last_done
+                entry[3] += 1
+            self._last_done = now
+            current = self._current_step()
+            if current is not self._current or now - self._reported >= PROGRESS_INTERVAL:
+                self._report()
+    
+    def finish(self):
+        with self._lock:
+            self._phase = 'done'
+            self._report()
+    
+    def report(self):
+        """Report the counts now"""
+        with self._lock:
+            self._report()
+    
+    def _current_step(self):
+        # With several workers, later steps may start before earlier ones
+        # finish; the step reported is the first with anything left
+        for entry in self._steps:
+            if entry[3] < entry[2]:
+                return entry
+        return self._steps[-1] if self._steps else None
+    
+    def _report(self):
+        now = time.monotonic()
+        self._current = self._current_step()
+        step = self._current[0] if self._current else None
+        elapsed = now - self._started if self._started is not None else 0.0
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self._phase == 'done':
+            eta = 0.0
+        elif rate > 0:
+            eta = (self.total - self.done) / rate
+        step_eta = None
+        if self._current is not None:
+            _, _, step_total, step_done, step_started = self._current
+            if self._phase == 'done' or step_done >= step_total:
+                step_eta = 0.0
+            elif step_started is not None and now > step_started:
+                step_eta = (step_total - step_done) * (now - step_started) / step_done
+        
+        self._reported = now
+        self.callback({
+            "phase": self._phase,
+            "step": step,
+            "step_title": STEP_TITLES.get(step),
+            "step_done": self._current[3] if self._current else 0,
+            "step_total": self._current[2] if self._current else 0,
+            "step_eta": round(step_eta, 1) if step_eta is not None else None,
+            "done": self.done,
+            "total": self.total,
+            "failed": self.failed,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "files": self.files,
+            "elapsed": round(elapsed, 3),
+            "rate": round(rate, 1),
+            "bytes_rate": round(self.bytes_done / elapsed if elapsed > 0 else 0.0),
+            "eta": round(eta, 1) if eta is not None else None,
+        })
+
+# Kept in the root of an organized folder; see load_manifest
+MANIFEST_NAME = '.organizer_manifest.json'
+MANIFEST_VERSION = 1
+
+def _manifest_key(folder_path, path):
+    return os.path.relpath(path, folder_path).replace(os.sep, '/')
+
+def load_manifest(folder_path):
+    """
+    Return the folders recorded by the last run on folder_path, as
+    {relative path: {'mtime_ns': ..., 'files': {name: [size, mtime_ns, name,
+    product_code, variant, category]}}}, or {} if there is no usable manifest.
+    """
+    try:
+        with open(os.path.join(folder_path, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable manifest in %s: %s", folder_path, e)
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['folders']
+
+def _settled_folders(folder_path, folders):
+    """
+    Return the folders whose contents, all the way down, are as the last run
+    left them: each was recorded in the manifest and its mtime (which changes
+    whenever an entry is added, removed or renamed in it) is unchanged.
+    Records of folders that are gone are dropped from folders.
+    """
+    unchanged = set()
+    for key, record in list(folders.items()):
+        try:
+            mtime_ns = os.stat(os.path.join(folder_path, key)).st_mtime_ns
+        except OSError:
+            del folders[key]
+            continue
+        if mtime_ns == record['mtime_ns']:
+            unchanged.add(key)
     
-    flatten_nested_folders(folder_path)
+    children = {}
+    for key in folders:
+        if key != '.':
+            children.setdefault(posixpath.dirname(key) or '.', []).append(key)
+    
+    settled = []
+    def visit(key):
+        result = key in unchanged
+        for child in children.get(key, ()):
+            result = visit(child) and result
+        if result:
+            settled.append(os.path.normpath(os.path.join(folder_path, key)))
+        return result
+    visit('.')
+    return settled
+
+def _update_manifest(folder_path, folders, view, failed):
+    """
+    Record in the manifest the folders the run looked at, as they are on disk
+    now. Folders a failed operation touched are recorded as changed so the
+    next run looks at them again.
+    
+    Files are listed from view, which is what the disk holds once the plan
+    has been applied; moves keep sizes and mtimes, so the ones view already
+    knows are not stat'ed again.
+    """
+    failed_folders = set()
+    for op in failed:
+        for path in (op.src, op.dst):
+            if path:
+                failed_folders.add(os.path.normpath(os.path.dirname(path)))
+                failed_folders.add(os.path.normpath(path))
+    
+    for path in view.loaded_folders():
+        key = _manifest_key(folder_path, path)
+        if key.split('/')[0].lower().startswith('__webp to be move to the right folders'):
+            continue # The WEBP drop folder is always looked at in full
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            files = [(name, view.stat(os.path.join(path, name))) for name in view.files(path)
+                     if not (key == '.' and name in (MANIFEST_NAME, JOURNAL_NAME))]
+        except OSError:
+            folders.pop(key, None)
+            continue
+        
+        parsed = parse_filenames([name for name, _ in files])
+        rows = zip(parsed['names'], parsed['codes'], parsed['variants'], parsed['categories'])
+        folders[key] = {
+            'mtime_ns': None if path in failed_folders else mtime_ns,
+            'files': {name: [*stat, *row] for (name, stat), row in zip(files, rows)},
+        }
+    
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'folders': folders}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except OSError as e:
+        logger.warning("Could not save the manifest to %s: %s", manifest_path, e)
+
+# Kept in the root of an organized folder; see Journal
+JOURNAL_NAME = '.organizer_journal'
+JOURNAL_VERSION = 1
+
+# Completed operations are synced to the journal in batches: after this many,
+# or once this many seconds have passed since the last sync. A crash loses
+# at most one batch, whose operations a resumed run finds applied on disk.
+JOURNAL_SYNC_EVERY = 256
+JOURNAL_SYNC_INTERVAL = 1.0
+
+class Journal:
+    """
+    Append-only record of a run's plan and of the operations it has applied,
+    kept in JOURNAL_NAME in the folder being organized.
+    
+    The plan is written and synced before anything is applied. Each applied
+    operation is then appended, synced in batches, and an end record once
+    the run is over. A journal without one is left by a run that was
+    interrupted, which the next run finishes (see Organizer._resume).
+    The journal of the last run that changed anything stays behind, so that
+    run can be backed out (see undo_last_run).
+    
+    The file holds JSON lines: a header {"version", "started",
+    "operations"}, one [kind, src, dst, size] per planned operation with
+    paths relative to the folder, the index of each applied operation, and
+    {"end": true}.
+    """
+    
+    def __init__(self, folder_path, operations, started=None, done=(), finished=False):
+        self.folder_path = folder_path
+        self.operations = operations
+        self.started = started or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.done = set(done) # indexes of the operations applied
+        self.finished = finished
+        self._index = {id(op): index for index, op in enumerate(operations)}
+        self._file = None
+        self._unsynced = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def path(self):
+        return os.path.join(self.folder_path, JOURNAL_NAME)
+    
+    @classmethod
+    def load(cls, folder_path):
+        """The journal an earlier run left in folder_path, or None"""
+        try:
+            with open(os.path.join(folder_path, JOURNAL_NAME), encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("Ignoring unreadable journal in %s: %s", folder_path, e)
+            return None
+        
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break # Torn by a crash while it was written; nothing after it was synced
+        if not records or not isinstance(records[0], dict) or records[0].get('version') != JOURNAL_VERSION:
+            return None
+        count = records[0]['operations']
+        if len(records) < count + 1:
+            return None # The plan was never synced, so none of it was applied
+        
+        def absolute(path):
+            return os.path.join(folder_path, path) if path is not None else None
+        operations = [Operation(kind, absolute(src), absolute(dst), size=size)
+                      for kind, src, dst, size in records[1:count + 1]]
+        done = [record for record in records[count + 1:] if isinstance(record, int)]
+        finished = any(isinstance(record, dict) and record.get('end') for record in records[count + 1:])
+        return cls(folder_path, operations, records[0].get('started'), done, finished)
+    
+    def start(self):
+        """Write the plan, in place of any earlier journal, and sync it"""
+        def relative(path):
+            return os.path.relpath(path, self.folder_path) if path is not None else None
+        
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': JOURNAL_VERSION, 'started': self.started,
+                                'operations': len(self.operations)}) + '\n')
+            for op in self.operations:
+                f.write(json.dumps([op.kind, relative(op.src), relative(op.dst), op.size]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.reopen()
+    
+    def reopen(self):
+        """Append to the journal on disk, e.g. to finish an interrupted run"""
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._synced_at = time.monotonic()
+    
+    def completed(self, op):
+        """Record that op, one of the planned operations, has been applied"""
+        index = self._index.get(id(op))
+        if index is None or self._file is None:
+            return
+        with self._lock:
+            self.done.add(index)
+            self._file.write(f"{index}\n")
+            self._unsynced += 1
+            if (self._unsynced >= JOURNAL_SYNC_EVERY
+                    or time.monotonic() - self._synced_at >= JOURNAL_SYNC_INTERVAL):
+                self._sync()
+    
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+    
+    def finish(self):
+        """Record the end of the run and close the journal"""
+        with self._lock:
+            self._file.write(json.dumps({'end': True}) + '\n')
+            self._sync()
+            self._file.close()
+            self._file = None
+            self.finished = True
+    
+    def applied(self):
+        """
+        The planned operations recorded as applied. Only complete once the
+        run is finished: a crash can lose the last batch.
+        """
+        return [op for index, op in enumerate(self.operations) if index in self.done]
+    
+    def moved_away(self):
+        """
+        Indexes of the folders made (mkdir) that a later operation has moved,
+        with the folder they are in, to where they are now. _applied cannot
+        tell those from folders still to make, by their path alone. The move
+        is known to be applied by its destination: its source is missing
+        both before the folder is made and after it is moved.
+        """
+        moved = {} # source -> index of the move
+        for index, op in enumerate(self.operations):
+            if op.kind not in ('mkdir', 'rmdir'):
+                moved.setdefault(op.src, index)
+        
+        made = set()
+        for index, op in enumerate(self.operations):
+            if op.kind != 'mkdir' or index in self.done:
+                continue
+            folder = op.dst
+            while folder != self.folder_path and os.path.dirname(folder) != folder:
+                later = moved.get(folder)
+                if later is not None and later > index:
+                    if later in self.done or os.path.lexists(self.operations[later].dst):
+                        made.add(index)
+                    break
+                folder = os.path.dirname(folder)
+        return made
+
+def _plan_run(folder_path, settled=()):
+    """
+    Plan steps 1-6 for folder_path; returns the operations, the resulting
+    view and the (step, index of its first operation) pairs of the steps
+    """
+    tree, plan = DirectoryIndex(settled), []
+    token = _active_plan.set((tree, plan))
+    try:
+        steps = _organize_steps(folder_path)
+        return plan, tree, steps
+    finally:
+        _active_plan.reset(token)
+
+def plan_organization(folder_path):
+    """
+    Plan steps 1-6 for folder_path without changing anything on disk.
+    Every file is parsed and categorized once; the result is the ordered list
+    of mkdir/move/archive/rmdir operations that execute_plan applies.
+    """
+    operations, _, _ = _plan_run(folder_path)
+    return operations
+
+class Organizer:
+    """
+    Configuration and caches for organizing folders: how many threads apply
+    a plan, the filename parser cache, the content-hash index (and the file
+    it is kept in between runs) and the least severe message a run keeps.
+
+    Runs of one Organizer share its caches, which are safe to use from
+    several threads; everything else belongs to the run. Runs on separate
+    folders can therefore go on in parallel threads, of one Organizer or of
+    several, without any locking by the caller.
+
+    The module-level functions (organize_files_web, plan_organization and the
+    steps) use the Organizer of the run in progress, or a default one set up
+    from the ORGANIZER_HASH_ALGORITHM and ORGANIZER_HASH_INDEX variables.
+    """
+    
+    def __init__(self, workers=None, hash_algorithm='md5', hash_index_path=None,
+                 log_level=logging.NOTSET):
+        self.workers = workers
+        self.parser = FilenameParser()
+        self.content_index = ContentIndex(hash_algorithm)
+        self.hash_index_path = hash_index_path
+        # DEBUG messages are only produced when the module logger is at
+        # DEBUG as well (see set_log_level)
+        self.log_level = log_level
+    
+    @contextmanager
+    def _running(self, listeners=(), progress=None, run_metrics=None):
+        organizer_token = _current_organizer.set(self)
+        listeners_token = _run_listeners.set(tuple(listeners))
+        progress_token = _plan_progress.set(progress)
+        try:
+            if run_metrics is None:
+                yield
+            else:
+                with metrics.recording(run_metrics):
+                    yield
+        finally:
+            _plan_progress.reset(progress_token)
+            _run_listeners.reset(listeners_token)
+            _current_organizer.reset(organizer_token)
+    
+    def plan(self, folder_path):
+        """plan_organization with this organizer's caches"""
+        with self._running():
+            operations, _, _ = _plan_run(folder_path)
+        return operations
+    
+    def organize(self, folder_path, dry_run=False, full_rebuild=False, progress=None, workers=None,
+                 on_progress=None, metrics=None):
+        """
+        organize_files_web with this organizer's configuration. Always
+        returns (success, messages, preview); preview is None unless dry_run.
+        """
+        messages = deque(maxlen=MAX_PROGRESS_MESSAGES)
+        listeners = [(messages.append, self.log_level)]
+        if progress is not None:
+            listeners.append((progress, max(self.log_level, logging.INFO)))
+        tracker = PlanProgress(on_progress) if on_progress is not None else None
+        
+        with self._running(listeners, tracker, metrics):
+            success, preview = self._organize(folder_path, dry_run, workers or self.workers, full_rebuild)
+        return success, list(messages), preview
+    
+    def ingest(self, archive, folder_path, progress=None):
+        """ingest_archive with this organizer's configuration"""
+        messages = deque(maxlen=MAX_PROGRESS_MESSAGES)
+        listeners = [(messages.append, self.log_level)]
+        if progress is not None:
+            listeners.append((progress, max(self.log_level, logging.INFO)))
+        
+        with self._running(listeners):
+            success = self._ingest(archive, folder_path)
+        return success, list(messages)
+    
+    def _ingest(self, archive, folder_path):
+        """Body of ingest; returns whether the archive could be read"""
+        if not os.path.isdir(folder_path):
+            logger.error("Folder '%s' does not exist.", folder_path)
+            return False
+        
+        _log_progress(f"Ingesting archive into: {folder_path}")
+        # Each member is planned against the view of folder_path and applied
+        # before the next one is read, so a tar can come from a stream
+        tree, plan = DirectoryIndex(), []
+        token = _active_plan.set((tree, plan))
+        extracted = failed = 0
+        try:
+            for member_name, member in _archive_members(archive):
+                start = len(plan)
+                if _plan_extract(folder_path, member_name) is None:
+                    continue
+                for op in plan[start:]:
+                    if op.kind == 'extract':
+                        if _extract_member(op, member):
+                            extracted += 1
+                        else:
+                            failed += 1
+                    elif not _apply_operation(op):
+                        failed += 1
+        except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+            logger.error("Could not read the archive: %s", e)
+            return False
+        finally:
+            _active_plan.reset(token)
+        
+        _log_progress(f"\nIngestion complete! {extracted} files extracted, {failed} operations failed.")
+        return True
+    
+    def _save_content_index(self):
+        if not self.hash_index_path:
+            return
+        try:
+            self.content_index.save(self.hash_index_path)
+        except OSError as e:
+            logger.warning("Could not save the hash index to %s: %s", self.hash_index_path, e)
+    
+    def _organize(self, folder_path, dry_run, workers, full_rebuild):
+        """Body of organize; returns (success, preview or None)"""
+        if not os.path.exists(folder_path):
+            logger.error("Folder '%s' does not exist.", folder_path)
+            return False, None
+    
+        _log_progress(f"Starting organization of: {folder_path}")
+        metrics.inc('runs_total', mode='dry_run' if dry_run else 'organize')
+        tracker = _plan_progress.get()
+        if tracker is not None:
+            tracker.report()
+    
+        if self.hash_index_path:
+            self.content_index.load(self.hash_index_path)
+    
+        journal = Journal.load(folder_path)
+        if journal is not None and not journal.finished:
+            if dry_run:
+                logger.warning("The next run on %s will finish an interrupted run instead of planning.",
+                               folder_path)
+            else:
+                # The interrupted plan is finished as it was made; planning
+                # again on a half-organized tree could move files twice
+                self._resume(journal, workers)
+                self._save_content_index()
+                if tracker is not None:
+                    tracker.finish()
+                _log_progress(f"\nInterrupted run finished. Run again to organize anything it did not plan.")
+                return True, None
+    
+        with metrics.timer('phase_seconds', phase='manifest'):
+            folders = {} if full_rebuild else load_manifest(folder_path)
+            settled = _settled_folders(folder_path, folders)
+        if settled:
+            _log_progress(f"Skipping {len(settled)} folders unchanged since the last run")
+            metrics.inc('settled_folders_total', len(settled))
+    
+        with metrics.timer('phase_seconds', phase='plan'):
+            operations, view, steps = _plan_run(folder_path, settled)
+        metrics.inc('files_total', view.file_count())
+        if tracker is not None:
+            tracker.planned(operations, steps, view.file_count())
+        cache = parser_cache_info()
+        logger.debug("Filename parser cache: %s hits, %s misses", cache.hits, cache.misses)
+        counts = summarize_plan(operations)
+        counts_text = ", ".join(f"{count} {kind}" for kind, count in counts.items())
+        if counts_text:
+            counts_text = f" ({counts_text})"
+        crossing = cross_device_moves(operations)
+        if crossing:
+            _log_progress(f"{len(crossing)} moves go to another file system and copy "
+                          f"{sum(op.size or 0 for op in crossing)} bytes instead of renaming")
+    
+        if dry_run:
+            preview = {
+                "operations": [op._asdict() for op in operations],
+                "undo": [op._asdict() for op in undo_plan(operations)],
+                "summary": counts,
+                "cross_device": [op._asdict() for op in crossing],
+                "layout": view.layout(folder_path),
+            }
+            _log_progress(f"\nDry run: {len(operations)} operations planned{counts_text}, nothing was changed.")
+            self._save_content_index()
+            if tracker is not None:
+                tracker.finish()
+            return True, preview
+    
+        if operations:
+            _log_progress(f"\nApplying {len(operations)} planned operations{counts_text}")
+        else:
+            _log_progress(f"\nNothing to change.")
+        # A run with nothing to do keeps the journal of the last one that
+        # did something, so that one can still be undone
+        journal = Journal(folder_path, operations) if operations else None
+        if journal is not None:
+            try:
+                journal.start()
+            except OSError as e:
+                logger.warning("Could not write the journal in %s, the run cannot be resumed or undone: %s",
+                               folder_path, e)
+                journal = None
+        token = _run_journal.set(journal)
+        try:
+            with metrics.timer('phase_seconds', phase='apply'):
+                failed = execute_plan(operations, workers)
+        finally:
+            _run_journal.reset(token)
+        self._save_content_index()
+        with metrics.timer('phase_seconds', phase='manifest'):
+            _update_manifest(folder_path, folders, view, failed)
+        if journal is not None:
+            journal.finish()
+        if tracker is not None:
+            tracker.finish()
+    
+        _log_progress(f"\nOrganization complete!")
+        return True, None
+
+    def _resume(self, journal, workers):
+        """Apply what an interrupted run left of its plan, as it planned it"""
+        journal.reopen()
+        for index in journal.moved_away():
+            journal.completed(journal.operations[index])
+        remaining = [op for index, op in enumerate(journal.operations) if index not in journal.done]
+        _log_progress(f"Finishing the interrupted run of {journal.started}: "
+                      f"{len(remaining)} of {len(journal.operations)} operations left")
+        tracker = _plan_progress.get()
+        if tracker is not None:
+            tracker.planned(remaining, [], 0)
+        token = _run_journal.set(journal)
+        try:
+            failed = execute_plan(remaining, workers, replay=True)
+        finally:
+            _run_journal.reset(token)
+        journal.finish()
+        metrics.inc('resumed_runs_total')
+        if failed:
+            logger.warning("%s operations of the interrupted run could not be applied.", len(failed))
+    
+    def undo(self, folder_path, progress=None, workers=None):
+        """undo_last_run with this organizer's configuration"""
+        messages = deque(maxlen=MAX_PROGRESS_MESSAGES)
+        listeners = [(messages.append, self.log_level)]
+        if progress is not None:
+            listeners.append((progress, max(self.log_level, logging.INFO)))
+        
+        with self._running(listeners):
+            success = self._undo(folder_path, workers or self.workers)
+        return success, list(messages)
+    
+    def _undo(self, folder_path, workers):
+        """Body of undo; returns whether everything was backed out"""
+        journal = Journal.load(folder_path)
+        if journal is None:
+            logger.error("There is no run to undo in '%s'.", folder_path)
+            return False
+        
+        if not journal.finished:
+            # What was applied is only known for sure once the run is done
+            self._resume(journal, workers)
+        operations = undo_plan(journal.applied())
+        _log_progress(f"Undoing the run of {journal.started}: {len(operations)} operations")
+        # Replayed, so undoing again after a crash or a failure picks up
+        # where the last attempt stopped
+        failed = execute_plan(operations, workers, replay=True)
+        self._save_content_index()
+        if failed:
+            logger.error("%s operations could not be undone; undo again to retry them.", len(failed))
+            return False
+        os.remove(journal.path)
+        _log_progress(f"\nUndo complete!")
+        return True
+
+# Used outside of an Organizer's run, e.g. by organize_files_web
+_default_organizer = Organizer(hash_algorithm=os.environ.get('ORGANIZER_HASH_ALGORITHM', 'md5'),
+                               hash_index_path=os.environ.get('ORGANIZER_HASH_INDEX'))
+
+def organize_files_web(folder_path, dry_run=False, workers=None, full_rebuild=False, progress=None,
+                       on_progress=None, metrics=None):
+    """
+    Main function to orchestrate the file organization process for web.
+    
+    With dry_run=True every step is simulated against an in-memory view of
+    the tree and nothing on disk is created, moved or removed. The result is
+    then (success, messages, preview), where preview holds the planned
+    'operations', the 'undo' operations that would back them out, a
+    'summary' count per kind, the moves that copy to another file system
+    ('cross_device') and the resulting 'layout' of the folder.
+    
+    workers sets how many threads apply the plan (see execute_plan); by
+    default the operations are applied one at a time.
+    
+    Each run records what it left behind in a manifest in folder_path (see
+    load_manifest). The next run skips folders that have not changed since,
+    so its work follows what was added rather than the size of the folder.
+    full_rebuild=True ignores the manifest, looks at everything and records
+    a new one.
+    
+    The plan and the operations applied are kept in a journal in
+    folder_path as the run goes (see Journal). If the run is interrupted,
+    the next one finishes its plan instead of making a new one, skipping
+    what was done, and the last run can be backed out with undo_last_run.
+    
+    progress, if given, is called with each message of this run (INFO and
+    above) as it is logged. Several runs can go on at once in different
+    threads, as long as their folders do not overlap.
+    
+    on_progress, if given, is called with structured counts of the work:
+    operations done out of the planned total, per step and overall, bytes
+    moved, throughput and an estimate of the time left (see PlanProgress).
+    
+    Counters and timings of the steps, the operations and the hot helpers
+    are recorded in metrics.REGISTRY, or in metrics (a metrics.Metrics) if
+    given, which then holds this run's alone; REGISTRY gets them when the
+    run is over.
+    """
+    success, messages, preview = _organizer().organize(
+        folder_path, dry_run=dry_run, full_rebuild=full_rebuild, progress=progress, workers=workers,
+        on_progress=on_progress, metrics=metrics)
+    if dry_run:
+        return success, messages, preview
+    return success, messages
+
+def undo_last_run(folder_path, progress=None, workers=None):
+    """
+    Back out the last run on folder_path that changed anything, from its
+    journal (see Journal): files go back where they were and the folders it
+    created are removed, newest first. An interrupted run is finished first,
+    since only then is it known for sure what it applied.
+    Operations that were backed out already are skipped, so after a
+    failure this can simply be called again. Returns (success, messages).
+    """
+    return _organizer().undo(folder_path, progress=progress, workers=workers)
+
+def ingest_archive(archive, folder_path, progress=None):
+    """
+    Organize the files of a zip or tar archive straight into folder_path.
+    Each member is classified like a file in a brand folder (step 4): it is
+    written once, to its brand/product/category folder, creating folders
+    and moving a file already at its place to Old Images as step 4 would.
+    A member whose name gives no brand uses the archive's top folder.
+    
+    archive is the path of the archive or a binary file object. A zip needs
+    a file object that can seek; a tar, compressed or not, can be read from
+    a stream such as a request body. Returns (success, messages).
+    """
+    return _organizer().ingest(archive, folder_path, progress=progress)
+
+# Bytes copied from an archive member to its file at a time
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+def _archive_members(archive):
+    """
+    Yield (name, file object) for each regular file of archive, in the order
+    they are stored. A member's file object can only be read until the next
+    member is asked for.
+    """
+    if isinstance(archive, (str, os.PathLike)):
+        is_zip = zipfile.is_zipfile(archive)
+    else:
+        is_zip = False
+        if archive.seekable():
+            position = archive.tell()
+            is_zip = zipfile.is_zipfile(archive)
+            archive.seek(position)
+    
+    if is_zip:
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir():
+                    with zip_file.open(info) as member:
+                        yield info.filename, member
+        return
+    
+    if isinstance(archive, (str, os.PathLike)):
+        tar = tarfile.open(archive, 'r|*')
+    else:
+        tar = tarfile.open(fileobj=archive, mode='r|*')
+    with tar:
+        for info in tar:
+            if info.isfile():
+                yield info.name, tar.extractfile(info)
+
+def _safe_segment(segment):
+    """
+    Whether segment, taken from an archive, can be one folder or file name
+    under the target folder: not empty, '.' or '..' (also once trailing dots
+    and spaces are dropped, as Windows does) and without a separator
+    """
+    return bool(segment.strip(' .')) and '/' not in segment and '\\' not in segment
+
+def _plan_extract(folder_path, member_name):
+    """Plan where archive member member_name goes under folder_path; returns the path, or None to skip it"""
+    # Only the file name and the top folder are used, and the names the
+    # parser gives are checked as well, so a member cannot point outside
+    # folder_path
+    parts = [p for p in member_name.replace('\\', '/').split('/') if _safe_segment(p)]
+    if not parts or parts[0] == '__MACOSX':
+        return None
+    
+    file = parts[-1]
+    name, product_code, variant, file_category = _classify(file)
+    if name and not _safe_segment(name):
+        name = None
+    if not name and len(parts) > 1:
+        name = parts[0]
+        logger.debug("Using archive folder name as brand: %s", name)
+    if not name:
+        _log_progress(f"Skipped '{file}': couldn't determine name.")
+        return None
+    if product_code and not _safe_segment(product_code):
+        product_code = None
+    
+    root = os.path.normpath(folder_path).rstrip(os.sep) + os.sep
+    if not os.path.normpath(os.path.join(folder_path, name, product_code or '', file)).startswith(root):
+        logger.error("Skipped %s: it would be written outside %s", member_name, folder_path)
+        return None
+    dst = _plan_destination(folder_path, file, name, product_code, file_category)
+    if not os.path.normpath(dst).startswith(root):
+        logger.error("Skipped %s: it would be written outside %s", member_name, folder_path)
+        return None
+    tree, plan = _active_plan.get()
+    tree.add_file(dst)
+    plan.append(Operation('extract', member_name, dst,
+                          f"Extracted {file} to: {os.path.relpath(dst, folder_path)}"))
+    return dst
+
+def _extract_member(op, member):
+    """Write the data of an archive member to op.dst, logging its message once it is there"""
+    part_path = op.dst + '.part'
+    try:
+        with open(part_path, 'wb') as f:
+            shutil.copyfileobj(member, f, EXTRACT_BUFFER_SIZE)
+        os.replace(part_path, op.dst)
+    except OSError as e:
+        logger.error("Could not extract %s: %s", op.src, e)
+        return False
+    finally:
+        # Left behind only if writing failed or the archive could not be read
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+    
+    if op.message:
+        _log_progress(op.message)
+    return True
+
+def _organize_steps(folder_path):
+    """
+    Plan steps 1-6 of the organization against folder_path. Returns (step,
+    index of its first operation) pairs for the steps that ran, in order.
+    """
+    _, plan = _active_plan.get()
+    steps = [(1, len(plan))]
+    with metrics.timer('plan_step_seconds', step=1):
+        flatten_nested_folders(folder_path)
     
-    webp_folder = None
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        if (os.path.isdir(item_path) and 
-            item.lower().startswith('__webp to be move to the right folders')):
-            webp_folder = item_path
-            break
+    webp_folder = find_webp_folder(folder_path)
     
     if webp_folder:
+        steps.append((2, len(plan)))
         _log_progress(f"\nStep 2: Organizing WEBP folder contents...")
-        organize_folder_contents(webp_folder, is_webp_folder=True)
+        with metrics.timer('plan_step_seconds', step=2):
+            organize_folder_contents(webp_folder, is_webp_folder=True)
         
+        steps.append((3, len(plan)))
         _log_progress(f"\nStep 3: Moving WEBP folders to main structure...")
-        move_webp_folders_to_main(folder_path)
+        with metrics.timer('plan_step_seconds', step=3):
+            move_webp_folders_to_main(folder_path)
     
+    steps.append((4, len(plan)))
     _log_progress(f"\nStep 4: Organizing files in brand folders...")
-    organize_files_in_brand_folders(folder_path)
+    with metrics.timer('plan_step_seconds', step=4):
+        organize_files_in_brand_folders(folder_path)
     
+    steps.append((5, len(plan)))
     _log_progress(f"\nStep 5: Organizing remaining folder contents...")
-    organize_folder_contents(folder_path)
+    with metrics.timer('plan_step_seconds', step=5):
+        organize_folder_contents(folder_path)
     
-    remove_empty_folders(folder_path)
+    steps.append((6, len(plan)))
+    with metrics.timer('plan_step_seconds', step=6):
+        remove_empty_folders(folder_path)
     
-    _log_progress(f"\nOrganization complete!")
-    return True, _progress_messages
+    for (step, first), (_, last) in zip(steps, steps[1:] + [(None, len(plan))]):
+        metrics.inc('planned_operations_total', last - first, step=step)
+    return steps
 
 # This part is for local testing of b-up.py, not used by Flask app
 if __name__ == "__main__":
@@ -0,0 +1,314 @@
+# staging.py
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+class StagingFull(Exception):
+    """There is no room in the staging area, even after evicting idle uploads"""
+
+class _Upload:
+    """One upload directory and what is known about it"""
+
+    __slots__ = ('path', 'bytes', 'created', 'last_used', 'writers')
+
+    def __init__(self, path, bytes_used=0, created=None, last_used=None):
+        self.path = path
+        self.bytes = bytes_used
+        self.created = created or time.time()
+        self.last_used = last_used or self.created
+        self.writers = 0 # requests writing to it right now (see StagingArea.writing)
+
+def _tree_size(path):
+    """Bytes in the files under path, and the newest mtime found there"""
+    total = 0
+    newest = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            total += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return total, newest
+
+class StagingArea:
+    """
+    The folder uploads are written to, one directory per upload, with the
+    space each one uses accounted for.
+
+    Writers reserve bytes before writing them. A reservation that would go
+    over quota_bytes, or leave less than min_free_bytes free on the disk,
+    first evicts idle uploads, least recently used first; if that is not
+    enough it raises StagingFull and nothing is evicted. An upload is idle
+    when it has not been used for IDLE_GRACE seconds, no request is writing
+    to it (see writing) and busy(path) is false, i.e. no job is working on
+    it.
+
+    The reaper thread (start_reaper) removes uploads unused for ttl seconds,
+    evicts idle ones while the disk is short of space, and measures every
+    upload again so the accounting follows links, extractions and
+    organizing. stats() reports the numbers.
+    """
+
+    IDLE_GRACE = 60
+
+    def __init__(self, root, quota_bytes, min_free_bytes=0, ttl=24 * 3600, prefix='upload_', busy=None):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self.busy = busy or (lambda path: False)
+        self._lock = threading.Lock()
+        self._uploads = {} # upload id -> _Upload
+        self._stop = threading.Event()
+        self._reaper = None
+        # Counters for stats()
+        self.expired = 0
+        self.evicted = 0
+        self.reclaimed_bytes = 0
+        self.refused = 0
+        self.rescan()
+
+    def create(self):
+        """Make the directory of a new upload; returns its id"""
+        with self._lock:
+            victims = self._make_room(0)
+        if victims is None:
+            raise StagingFull(self._full_message())
+        self._delete(victims)
+        path = tempfile.mkdtemp(prefix=self.prefix, dir=self.root)
+        upload_id = os.path.basename(path)
+        with self._lock:
+            self._uploads[upload_id] = _Upload(path)
+        return upload_id
+
+    def get(self, upload_id):
+        """Directory of an upload, marking it used, or None if there is no such upload"""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload.last_used = time.time()
+            return upload.path
+
+    def reserve(self, upload_id, nbytes):
+        """
+        Account for nbytes about to be written to an upload, evicting idle
+        uploads if needed. Raises StagingFull if there is no room, or
+        KeyError for an unknown upload.
+        """
+        with self._lock:
+            upload = self._uploads[upload_id]
+            upload.last_used = time.time()
+            victims = self._make_room(nbytes, keep=upload_id)
+            if victims is None:
+                raise StagingFull(self._full_message())
+            upload.bytes += nbytes
+        self._delete(victims)
+
+    @contextmanager
+    def writing(self, upload_id):
+        """
+        Mark an upload as being written to for the body of a with statement,
+        however long it takes: it is not idle meanwhile, so it is neither
+        evicted nor expired, and rescan leaves its reservation alone
+        """
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                upload.writers += 1
+                upload.last_used = time.time()
+        try:
+            yield
+        finally:
+            if upload is not None:
+                with self._lock:
+                    upload.writers -= 1
+                    upload.last_used = time.time()
+    
+    def adjust(self, upload_id, nbytes):
+        """Correct a reservation by nbytes (negative if less was written)"""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                upload.bytes = max(0, upload.bytes + nbytes)
+
+    def refresh(self, upload_id):
+        """Measure an upload again, after writes that were not reserved"""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            return
+        bytes_used = _tree_size(upload.path)[0]
+        with self._lock:
+            upload.bytes = bytes_used
+
+    def uploads(self):
+        """Directories of all uploads, by id"""
+        with self._lock:
+            return {upload_id: upload.path for upload_id, upload in self._uploads.items()}
+
+    def remove(self, upload_id):
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is not None:
+            self._delete([upload])
+
+    def used_bytes(self):
+        with self._lock:
+            return self._used()
+
+    def _used(self):
+        return sum(upload.bytes for upload in self._uploads.values())
+
+    def _free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def _short_by(self, nbytes):
+        """Bytes that would have to go for nbytes more to fit (caller holds the lock)"""
+        short = self._used() + nbytes - self.quota_bytes
+        if self.min_free_bytes:
+            short = max(short, self.min_free_bytes - (self._free_bytes() - nbytes))
+        return short
+
+    def _idle(self, now):
+        """Uploads that may be evicted, least recently used first (caller holds the lock)"""
+        idle = [(upload_id, upload) for upload_id, upload in self._uploads.items()
+                if now - upload.last_used >= self.IDLE_GRACE and not upload.writers]
+        idle.sort(key=lambda item: item[1].last_used)
+        for upload_id, upload in idle:
+            if self.busy(upload.path):
+                # A job is working on it; its time to live starts once it is done
+                upload.last_used = now
+            else:
+                yield upload_id, upload
+
+    def _full_message(self):
+        return f"Staging area is full ({self._used()} of {self.quota_bytes} bytes used)"
+
+    def _make_room(self, nbytes, keep=None, partial=False):
+        """
+        Take enough idle uploads out of the area for nbytes to fit and return
+        them for _delete. If that is not possible, count a refusal and return
+        None, or with partial=True take out every idle upload anyway.
+        (Caller holds the lock.)
+        """
+        short = self._short_by(nbytes)
+        if short <= 0:
+            return []
+        victims = []
+        for upload_id, upload in self._idle(time.time()):
+            if upload_id == keep:
+                continue
+            victims.append((upload_id, upload))
+            short -= upload.bytes
+            if short <= 0:
+                break
+        if short > 0 and not partial:
+            self.refused += 1
+            return None
+        for upload_id, upload in victims:
+            del self._uploads[upload_id]
+        self.evicted += len(victims)
+        return [upload for _, upload in victims]
+
+    def _delete(self, uploads):
+        for upload in uploads:
+            shutil.rmtree(upload.path, ignore_errors=True)
+        with self._lock:
+            self.reclaimed_bytes += sum(upload.bytes for upload in uploads)
+
+    def rescan(self):
+        """
+        Measure every upload directory, taking in any the area did not know
+        about. The scan runs without the lock, so uploads created, reserved
+        into or written to since it started keep what the area knows of them.
+        """
+        started = time.time()
+        found = {}
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(self.prefix) and os.path.isdir(path):
+                found[name] = _tree_size(path)
+
+        def changed(upload):
+            return upload.writers or upload.created >= started or upload.last_used >= started
+
+        with self._lock:
+            for upload_id, upload in list(self._uploads.items()):
+                if upload_id not in found and not changed(upload):
+                    del self._uploads[upload_id]
+            for upload_id, (bytes_used, newest) in found.items():
+                upload = self._uploads.get(upload_id)
+                if upload is None:
+                    # Left over from before a restart: idle since its last write
+                    try:
+                        created = os.stat(os.path.join(self.root, upload_id)).st_mtime
+                    except OSError:
+                        continue # Removed since it was measured
+                    self._uploads[upload_id] = _Upload(os.path.join(self.root, upload_id), bytes_used,
+                                                       created, max(created, newest))
+                elif not changed(upload):
+                    upload.bytes = bytes_used
+
+    def reap(self):
+        """Remove uploads unused for ttl seconds, then evict idle ones until the quota and free space hold"""
+        now = time.time()
+        with self._lock:
+            expired = [upload for upload_id, upload in self._idle(now) if now - upload.last_used >= self.ttl]
+            for upload in expired:
+                del self._uploads[os.path.basename(upload.path)]
+            self.expired += len(expired)
+            # Under pressure, free what can be freed even if it is not enough
+            victims = self._make_room(0, partial=True)
+        self._delete(expired + victims)
+
+    def start_reaper(self, interval=60):
+        """Run rescan and reap every interval seconds on a daemon thread"""
+        if self._reaper is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.rescan()
+                    self.reap()
+                except OSError:
+                    pass
+
+        self._reaper = threading.Thread(target=run, name='staging-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop.set()
+
+    def stats(self):
+        """Usage and disk pressure of the staging area"""
+        disk = shutil.disk_usage(self.root)
+        now = time.time()
+        with self._lock:
+            used = self._used()
+            uploads = len(self._uploads)
+            oldest = min((upload.last_used for upload in self._uploads.values()), default=now)
+        return {
+            "root": self.root,
+            "uploads": uploads,
+            "used_bytes": used,
+            "quota_bytes": self.quota_bytes,
+            "quota_used": round(used / self.quota_bytes, 4) if self.quota_bytes else None,
+            "disk_total_bytes": disk.total,
+            "disk_free_bytes": disk.free,
+            "min_free_bytes": self.min_free_bytes,
+            "least_recently_used_age": round(now - oldest, 1),
+            "ttl": self.ttl,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "refused": self.refused,
+        }
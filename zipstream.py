@@ -0,0 +1,271 @@
+# zipstream.py
+import bisect
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Bytes read from a file at a time while it is streamed
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Largest value of the 32-bit size and offset fields; anything larger needs
+# the zip64 extensions
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP32_MAX_ENTRIES = 0xFFFF
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+# CRC-32 of files already streamed, by (path, size, mtime_ns), so resuming a
+# download does not read the files before the resume point again
+_CRC_CACHE_SIZE = 100000
+_crc_cache = OrderedDict()
+_crc_cache_lock = threading.Lock()
+
+def _dos_time(mtime):
+    """(date, time) fields of a zip entry for a modification time"""
+    t = time.localtime(max(mtime, 315532800)) # Zip dates start in 1980
+    return ((t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+class _Entry:
+    """One file or folder of a ZipStream and where its parts start"""
+
+    __slots__ = ('name', 'path', 'size', 'mtime_ns', 'date', 'time', 'offset', 'crc')
+
+    def __init__(self, name, path, size, mtime_ns):
+        self.name = name.encode('utf-8')
+        self.path = path # None for a folder
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.date, self.time = _dos_time(mtime_ns / 1e9)
+        self.offset = 0 # Of the local header
+        self.crc = None if path else 0
+
+    @property
+    def zip64(self):
+        return self.size >= _ZIP32_LIMIT
+
+    def local_header(self):
+        if self.path is None:
+            flags, extra, size = _FLAG_UTF8, b'', 0
+        elif self.zip64:
+            flags = _FLAG_UTF8 | _FLAG_DATA_DESCRIPTOR
+            extra = struct.pack('<HHQQ', 0x0001, 16, self.size, self.size)
+            size = _ZIP32_LIMIT
+        else:
+            flags, extra, size = _FLAG_UTF8 | _FLAG_DATA_DESCRIPTOR, b'', self.size
+        # Sizes are known up front and given here as well, so readers that
+        # go by local headers alone can still find the end of each file
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if self.zip64 else 20, flags, 0,
+                           self.time, self.date, 0, size, size,
+                           len(self.name), len(extra)) + self.name + extra
+
+    def local_header_size(self):
+        return 30 + len(self.name) + (20 if self.zip64 and self.path else 0)
+
+    def descriptor(self):
+        if self.path is None:
+            return b''
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    def descriptor_size(self):
+        if self.path is None:
+            return 0
+        return 24 if self.zip64 else 16
+
+    def _central_extra(self):
+        fields = []
+        if self.zip64:
+            fields += [self.size, self.size]
+        if self.offset >= _ZIP32_LIMIT:
+            fields.append(self.offset)
+        if not fields:
+            return b''
+        return struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields)
+
+    def central_record(self):
+        extra = self._central_extra()
+        size = _ZIP32_LIMIT if self.zip64 else self.size
+        flags = _FLAG_UTF8 if self.path is None else _FLAG_UTF8 | _FLAG_DATA_DESCRIPTOR
+        # External attributes: Unix mode in the high word, MS-DOS folder bit
+        if self.path is None:
+            attributes = (0o40755 << 16) | 0x10
+        else:
+            attributes = 0o100644 << 16
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 45, 45 if extra else 20,
+                           flags, 0, self.time, self.date, self.crc, size, size,
+                           len(self.name), len(extra), 0, 0, 0, attributes,
+                           min(self.offset, _ZIP32_LIMIT)) + self.name + extra
+
+    def central_record_size(self):
+        return 46 + len(self.name) + len(self._central_extra())
+
+class ZipStream:
+    """
+    A zip of a folder that is produced as it is read, never staged on disk.
+
+    Entries are stored, not compressed: the catalog is JPEG, WEBP and MP4,
+    which do not shrink, and stored entries make the size of the archive
+    and the offset of every byte known before anything is read. That is
+    what lets read(start, stop) serve any byte range, for Content-Length
+    and for resuming a download, while only holding one buffer of a file at
+    a time. Archives over 4 GB or 65535 entries use the zip64 extensions.
+
+    Everything sits in one top folder, called name (by default the name of
+    the folder), and names in exclude are left out. The archive reflects
+    the files as they were listed when the ZipStream was made; etag changes
+    when any of them is added, removed or modified.
+    """
+
+    def __init__(self, root, name=None, exclude=()):
+        root = os.path.normpath(root)
+        name = name or os.path.basename(root)
+        exclude = set(exclude)
+        self.root = root
+        self._entries = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            relative = os.path.relpath(dirpath, root).replace(os.sep, '/')
+            relative = name if relative == '.' else f"{name}/{relative}"
+            stat = os.stat(dirpath)
+            self._entries.append(_Entry(relative + '/', None, 0, stat.st_mtime_ns))
+            for filename in sorted(filenames):
+                if filename in exclude:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                self._entries.append(_Entry(f"{relative}/{filename}", path, stat.st_size, stat.st_mtime_ns))
+        self._layout()
+
+        digest = hashlib.sha1()
+        for entry in self._entries:
+            digest.update(b'%s\0%d\0%d\n' % (entry.name, entry.size, entry.mtime_ns))
+        self.etag = digest.hexdigest()
+
+    def _layout(self):
+        # The archive as a list of parts: (start offset, kind, entry index).
+        # Offsets are computed once; bytes are only made when read.
+        self._starts = []
+        self._parts = []
+        offset = 0
+
+        def add(kind, index, length):
+            nonlocal offset
+            if length:
+                self._starts.append(offset)
+                self._parts.append((kind, index))
+                offset += length
+
+        for index, entry in enumerate(self._entries):
+            entry.offset = offset
+            add('header', index, entry.local_header_size())
+            add('data', index, entry.size)
+            add('descriptor', index, entry.descriptor_size())
+
+        self._central_offset = offset
+        for index, entry in enumerate(self._entries):
+            add('central', index, entry.central_record_size())
+        self._central_size = offset - self._central_offset
+
+        end = self._end_records()
+        add('end', None, len(end))
+        self.size = offset
+
+    def _end_records(self):
+        count = len(self._entries)
+        records = b''
+        if (count > _ZIP32_MAX_ENTRIES or self._central_offset >= _ZIP32_LIMIT
+                or self._central_size >= _ZIP32_LIMIT):
+            zip64_offset = self._central_offset + self._central_size
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0,
+                                   count, count, self._central_size, self._central_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+            return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF,
+                                         _ZIP32_LIMIT, _ZIP32_LIMIT, 0)
+        return struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                           self._central_size, self._central_offset, 0)
+
+    def _part_bytes(self, kind, index):
+        if kind == 'header':
+            return self._entries[index].local_header()
+        if kind == 'descriptor':
+            return self._entries[index].descriptor()
+        if kind == 'central':
+            return self._entries[index].central_record()
+        return self._end_records()
+
+    def _crc(self, entry):
+        """CRC-32 of a file, read in full unless it has been seen already"""
+        if entry.crc is not None:
+            return entry.crc
+        key = (entry.path, entry.size, entry.mtime_ns)
+        with _crc_cache_lock:
+            crc = _crc_cache.get(key)
+        if crc is None:
+            crc = 0
+            for chunk in self._file_chunks(entry, 0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+            _remember_crc(key, crc)
+        entry.crc = crc
+        return crc
+
+    def _file_chunks(self, entry, start, stop):
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(READ_BUFFER_SIZE, remaining))
+                if not chunk:
+                    raise OSError(f"{entry.path} changed while it was being sent")
+                remaining -= len(chunk)
+                yield chunk
+
+    def _data_chunks(self, entry, start, stop):
+        if start or entry.crc is not None:
+            yield from self._file_chunks(entry, start, stop)
+            return
+        # Read from the start: work out the CRC for the descriptor on the way
+        crc = 0
+        for chunk in self._file_chunks(entry, 0, stop):
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        if stop == entry.size:
+            entry.crc = crc
+            _remember_crc((entry.path, entry.size, entry.mtime_ns), crc)
+
+    def read(self, start=0, stop=None):
+        """Yield the bytes of the archive from start up to stop (default: the end)"""
+        stop = self.size if stop is None else min(stop, self.size)
+        part = max(0, bisect.bisect_right(self._starts, start) - 1)
+        while part < len(self._parts) and self._starts[part] < stop:
+            kind, index = self._parts[part]
+            part_start = self._starts[part]
+            part_stop = self._starts[part + 1] if part + 1 < len(self._parts) else self.size
+            low = max(start, part_start) - part_start
+            high = min(stop, part_stop) - part_start
+            if kind == 'data':
+                yield from self._data_chunks(self._entries[index], low, high)
+            else:
+                if kind in ('descriptor', 'central') and self._entries[index].path:
+                    self._crc(self._entries[index])
+                yield self._part_bytes(kind, index)[low:high]
+            part += 1
+
+    def __iter__(self):
+        return self.read()
+
+def _remember_crc(key, crc):
+    with _crc_cache_lock:
+        _crc_cache[key] = crc
+        _crc_cache.move_to_end(key)
+        while len(_crc_cache) > _CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)